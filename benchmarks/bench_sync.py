@@ -0,0 +1,151 @@
+'''
+LDES SYNC BENCHMARK
+Concerns of the sync benchmark:
+ - Measuring onboarding, the initial crawl and steady-state polling of a view served by the local mock LDES server
+ - Reporting the throughput (fragments per second), the memory peak and the size of the database of every phase,
+   as a baseline to judge performance changes against
+
+Run from the root of the repository, e.g.:
+    python -m benchmarks.bench_sync --fragments 2000 --fan-out 4 --polls 3 --json
+'''
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import LdesManager, LdesSyncer, LdesClient, LdesStore, LdesHttpPool, LdesRateLimiter, LdesMetrics
+from benchmarks.mock_ldes_server import MockLdesServer, VALIDATORS
+
+ALIAS = 'bench'
+
+
+def get_db_size(store: LdesStore) -> int:
+    return sum(os.path.getsize(path) for path in (store.connection_string, f'{store.connection_string}-wal') if os.path.exists(path))
+
+def get_max_rss() -> int:
+    """Returns the peak resident set size of the process in bytes (ru_maxrss is in kilobytes on Linux, bytes on macOS)."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class SyncBenchmark():
+
+    def __init__(self, server: MockLdesServer, directory: str, max_workers: int = 8, max_per_host: int = 4, codec: str = None, stream_threshold: int = 0):
+        self.server = server
+        self.directory = directory
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.codec = codec
+        self.stream_threshold = stream_threshold
+        self.results: List[Dict[str, object]] = []
+
+    def run(self, polls: int) -> List[Dict[str, object]]:
+        location = self.server.start()
+        store = LdesStore(self.directory, ALIAS, codec=self.codec)
+        # the benchmark measures the syncer and the store, so the requests against localhost are not paced
+        client = LdesClient(LdesHttpPool(), LdesRateLimiter(), LdesMetrics(), self.stream_threshold)
+        try:
+            with self.measure('onboard', store):
+                LdesManager(ALIAS, store, client).onboard_ldes_view(ALIAS, location, polling=3600)
+            # nodes only become due when the steady-state polls force them, so that every poll covers the view exactly once
+            syncer = LdesSyncer(ALIAS, store, client, max_workers=self.max_workers, max_per_host=self.max_per_host)
+            syncer.start_sync()
+            # a single cycle follows the relations until the frontier is drained
+            with self.measure('initial_crawl', store):
+                self.run_cycle(syncer)
+            for index in range(polls):
+                # all nodes are made due at once, so that every cycle polls the entire view
+                with store.transaction():
+                    store.get_connection().execute("UPDATE nodes SET next_poll=datetime('now') WHERE immutable=0")
+                with self.measure(f'poll_{index + 1}', store):
+                    self.run_cycle(syncer)
+            syncer.finish_sync()
+        finally:
+            self.server.stop()
+        return self.results
+
+    def run_cycle(self, syncer: LdesSyncer):
+        # the syncer reports its progress on stderr, which would dominate the measurement
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            syncer.run_cycle()
+
+    @contextlib.contextmanager
+    def measure(self, phase: str, store: LdesStore):
+        requests = {status: self.server.get_requests(status) for status in (200, 304, 503)}
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            fetched = {status: self.server.get_requests(status) - count for status, count in requests.items()}
+            stats = store.get_stats()
+            self.results.append({
+                'phase': phase,
+                'seconds': round(seconds, 3),
+                'fragments': fetched[200],
+                'not_modified': fetched[304],
+                'errors': fetched[503],
+                'fragments_per_second': round((fetched[200] + fetched[304]) / seconds, 1) if seconds else 0,
+                'members': stats['members'],
+                'peak_memory': peak,
+                'max_rss': get_max_rss(),
+                'db_size': get_db_size(store),
+            })
+
+
+def format_table(results: List[Dict[str, object]]) -> str:
+    columns = list(results[0].keys())
+    rows = [[str(result[column]) for column in columns] for result in results]
+    widths = [max(len(column), *(len(row[index]) for row in rows)) for index, column in enumerate(columns)]
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ['  '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows]
+    return '\n'.join(lines)
+
+def configure_arg_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark onboarding, crawling and polling an LDES view served by a local mock server.')
+    parser.add_argument('--fragments', default=500, type=int, help='The number of fragments of the view.')
+    parser.add_argument('--fan-out', default=2, type=int, help='The number of relations of every fragment.')
+    parser.add_argument('--fan-in', default=1, type=int, help='The number of relations reaching every fragment.')
+    parser.add_argument('--members', default=10, type=int, help='The number of members of every fragment.')
+    parser.add_argument('--payload-size', default=200, type=int, help='The number of characters of the literal of every member.')
+    parser.add_argument('--entities', default=1000, type=int, help='The number of entities the members are versions of.')
+    parser.add_argument('--not-modified-ratio', default=0.9, type=float, help='The ratio of the polls answered with a 304.')
+    parser.add_argument('--latency', default=0.0, type=float, help='The latency of every response in seconds.')
+    parser.add_argument('--content-type', default='text/turtle', help='The content type of the fragments.')
+    parser.add_argument('--validators', default='etag', choices=VALIDATORS, help='The validators the server sends.')
+    parser.add_argument('--error-ratio', default=0.0, type=float, help='The ratio of the requests answered with a 503.')
+    parser.add_argument('--polls', default=3, type=int, help='The number of steady-state polls of all fragments.')
+    parser.add_argument('--max-workers', default=8, type=int, help='The number of concurrent fetches of the syncer.')
+    parser.add_argument('--max-per-host', default=4, type=int, help='The number of concurrent fetches per host.')
+    parser.add_argument('--stream-threshold', default=0, type=int, help='The number of characters above which N-Triples fragments are spooled to disk.')
+    parser.add_argument('--codec', default=None, help='The codec the payloads are stored with.')
+    parser.add_argument('--seed', default=42, type=int, help='The seed of the 304 responses.')
+    parser.add_argument('--directory', default=None, help='The directory of the database, a temporary one by default.')
+    parser.add_argument('--json', action='store_true', help='Prints the results as JSON instead of a table.')
+    return parser.parse_args()
+
+def main():
+    args = configure_arg_parser()
+    server = MockLdesServer(args.fragments, args.fan_out, args.fan_in, args.members, args.payload_size, args.entities,
+        args.not_modified_ratio, args.latency, args.content_type, args.validators, args.seed, args.error_ratio)
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.directory or temporary
+        if args.directory:
+            os.makedirs(directory, exist_ok=True)
+        results = SyncBenchmark(server, directory, args.max_workers, args.max_per_host, args.codec, args.stream_threshold).run(args.polls)
+    print(json.dumps(results, indent=2) if args.json else format_table(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+'''
+MOCK LDES SERVER
+Concerns of the mock LDES server:
+ - Serving a synthetic LDES view on localhost: a tree of fragments with a configurable size, fan-out and member payloads
+ - Answering conditional requests (ETag or Last-Modified) with 304s at a configurable ratio, the other polls find the fragment changed
+ - Simulating network latency and transient server errors, so that benchmarks can be run reproducibly without a real LDES server
+'''
+import datetime
+import email.utils
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Set
+
+TREE = 'https://w3id.org/tree#'
+LDES = 'https://w3id.org/ldes#'
+PYLDES = 'https://pyldes.org/spec/'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+XSD_DATETIME = 'http://www.w3.org/2001/XMLSchema#dateTime'
+IS_VERSION_OF = 'http://purl.org/dc/terms/isVersionOf'
+GENERATED_AT = 'http://www.w3.org/ns/prov#generatedAtTime'
+VALUE = 'http://example.org/value'
+
+# the validators the server sends: etags, Last-Modified dates or none at all (every poll is answered with a 200)
+VALIDATORS = ['etag', 'last-modified', 'none']
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class MockLdesServer():
+    """A synthetic LDES view of fragments linked as a tree, fragment i links to fragments i*fan_out+1 ... i*fan_out+fan_out.
+    With a fan_in above 1 the ranges overlap, fragment i links to fan_in-1 more fragments, the first children of its siblings.
+
+    Every fragment holds members versions of entities, with a literal of payload_size characters each. A poll of a
+    fragment carrying its current validator is answered with a 304 at not_modified_ratio, otherwise the fragment changes:
+    it gets a new version holding a new member. Without validators every poll after the first one counts as conditional,
+    an unchanged fragment is sent again as it was. The bodies are N-Triples, which are valid Turtle as well.
+    At error_ratio a request is answered with a 503 without Retry-After, as an overloaded server would.
+    """
+
+    def __init__(self, fragments: int = 1000, fan_out: int = 2, fan_in: int = 1, members: int = 10, payload_size: int = 200, entities: int = 1000,
+            not_modified_ratio: float = 0.9, latency: float = 0.0, content_type: str = 'text/turtle', validators: str = 'etag', seed: int = 42,
+            error_ratio: float = 0.0):
+        self.fragments = fragments
+        self.fan_out = fan_out
+        self.fan_in = max(1, fan_in)
+        self.members = members
+        self.payload_size = payload_size
+        self.entities = entities
+        self.not_modified_ratio = not_modified_ratio
+        self.latency = latency
+        self.content_type = content_type
+        self.validators = validators
+        self.error_ratio = error_ratio
+        self.random = random.Random(seed)
+        self.versions: Dict[int, int] = {}
+        self.requests: Dict[int, int] = {}
+        self.requested: Set[int] = set()
+        self.lock = threading.Lock()
+        self.server = None
+        self.base = None
+
+    @property
+    def location(self) -> str:
+        return f'{self.base}/fragments/0'
+
+    def start(self) -> str:
+        """Starts serving on a free port and returns the location of the root fragment."""
+        mock = self
+        class MockHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                mock.handle(self)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+        self.server.daemon_threads = True
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, name='mock-ldes', daemon=True).start()
+        return self.location
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def get_requests(self, status: int) -> int:
+        with self.lock:
+            return self.requests.get(status, 0)
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            fragment = int(request.path.rsplit('/', 1)[-1])
+        except ValueError:
+            fragment = -1
+        if not 0 <= fragment < self.fragments:
+            return self.respond(request, 404)
+        with self.lock:
+            is_error = self.random.random() < self.error_ratio if self.error_ratio else False
+        if is_error:
+            return self.respond(request, 503)
+        with self.lock:
+            version = self.versions.setdefault(fragment, 0)
+            is_modified = True
+            if self.is_conditional(request, fragment, version):
+                is_modified = self.random.random() >= self.not_modified_ratio
+                if is_modified:
+                    version = self.versions[fragment] = version + 1
+            self.requested.add(fragment)
+        if not is_modified and self.validators != 'none':
+            return self.respond(request, 304, fragment=fragment, version=version)
+        body = self.get_fragment(fragment, version).encode()
+        self.respond(request, 200, body, fragment, version)
+
+    def is_conditional(self, request: BaseHTTPRequestHandler, fragment: int, version: int) -> bool:
+        if self.validators == 'etag':
+            return request.headers.get('If-None-Match') == self.get_etag(fragment, version)
+        elif self.validators == 'last-modified':
+            return request.headers.get('If-Modified-Since') == self.get_last_modified(fragment, version)
+        return fragment in self.requested
+
+    def respond(self, request: BaseHTTPRequestHandler, status: int, body: bytes = b'', fragment: int = None, version: int = None):
+        with self.lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+        request.send_response(status)
+        if fragment is not None and self.validators == 'etag':
+            request.send_header('ETag', self.get_etag(fragment, version))
+        elif fragment is not None and self.validators == 'last-modified':
+            request.send_header('Last-Modified', self.get_last_modified(fragment, version))
+        if status == 200:
+            request.send_header('Content-Type', f'{self.content_type}; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def get_etag(self, fragment: int, version: int) -> str:
+        return f'"{fragment}-{version}"'
+
+    def get_last_modified(self, fragment: int, version: int) -> str:
+        return email.utils.format_datetime(START + datetime.timedelta(minutes=fragment, hours=version), usegmt=True)
+
+    def get_fragment(self, fragment: int, version: int) -> str:
+        node = f'<{self.base}/fragments/{fragment}>'
+        stream = f'<{self.base}/stream>'
+        view = f'<{self.base}/view>'
+        lines: List[str] = [
+            f'{node} <{RDF_TYPE}> <{TREE}Node> .',
+            f'{node} <{TREE}viewDescription> {view} .',
+            f'{view} <{RDF_TYPE}> <{TREE}ViewDescription> .',
+            f'{view} <{PYLDES}alias> "bench" .',
+            f'{stream} <{RDF_TYPE}> <{LDES}EventStream> .',
+            f'{stream} <{LDES}versionOfPath> <{IS_VERSION_OF}> .',
+            f'{stream} <{LDES}timestampPath> <{GENERATED_AT}> .',
+        ]
+        last_child = fragment * self.fan_out + self.fan_out + self.fan_in - 1
+        for child in range(fragment * self.fan_out + 1, min(last_child + 1, self.fragments)):
+            relation = f'_:r{child}'
+            lines += [
+                f'{node} <{TREE}relation> {relation} .',
+                f'{relation} <{RDF_TYPE}> <{TREE}GreaterThanOrEqualToRelation> .',
+                f'{relation} <{TREE}path> <{GENERATED_AT}> .',
+                f'{relation} <{TREE}value> "{self.get_timestamp(child, 0)}"^^<{XSD_DATETIME}> .',
+                f'{relation} <{TREE}node> <{self.base}/fragments/{child}> .',
+            ]
+        # a changed fragment holds one new member for every version
+        for index in range(self.members + version):
+            member = f'<{self.base}/members/{fragment}-{index}>'
+            lines += [
+                f'{stream} <{TREE}member> {member} .',
+                f'{member} <{IS_VERSION_OF}> <{self.base}/entities/{(fragment * self.members + index) % self.entities}> .',
+                f'{member} <{GENERATED_AT}> "{self.get_timestamp(fragment, index)}"^^<{XSD_DATETIME}> .',
+                f'{member} <{VALUE}> "{"x" * self.payload_size}" .',
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def get_timestamp(self, fragment: int, index: int) -> str:
+        return (START + datetime.timedelta(minutes=fragment, seconds=index)).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -1,19 +1,45 @@
 from dependency_injector import containers, providers
-from services import LdesManager, LdesStore, LdesSyncer, LdesClient
+from services import LdesManager, LdesStore, LdesSyncer, LdesClient, LdesHttpPool, LdesRateLimiter, LdesCircuitBreaker, LdesMetrics, LdesDaemon, create_emitters
 
 class Container(containers.DeclarativeContainer):
 
     config = providers.Configuration(yaml_files=["config.yml"])
 
+    ldes_http_pool = providers.Singleton(LdesHttpPool, timeout=config.sync.timeout)
+
+    ldes_rate_limiter = providers.Singleton(LdesRateLimiter, max_requests_per_second=config.sync.max_requests_per_second, burst=config.sync.burst)
+
+    ldes_circuit_breaker = providers.Singleton(LdesCircuitBreaker, failure_threshold=config.sync.failure_threshold,
+        cooldown=config.sync.breaker_cooldown, max_cooldown=config.sync.max_poll_interval)
+
+    ldes_metrics = providers.Singleton(LdesMetrics,)
+
     ldes_manager_factory = providers.Factory(
         LdesManager,
-        ldes_client = providers.Factory(LdesClient,),
-        ldes_store = providers.Singleton(LdesStore,)
+        ldes_client = providers.Factory(LdesClient, http_pool=ldes_http_pool, rate_limiter=ldes_rate_limiter, metrics=ldes_metrics,
+            stream_threshold=config.sync.stream_threshold, circuit_breaker=ldes_circuit_breaker, max_retries=config.sync.max_retries,
+            retry_backoff=config.sync.retry_backoff, max_retry_delay=config.sync.max_retry_delay),
+        ldes_store = providers.Singleton(LdesStore, codec=config.storage.codec)
     )
 
     ldes_syncer_factory = providers.Factory(
         LdesSyncer,
-        ldes_client = providers.Factory(LdesClient,),
-        ldes_store = providers.Singleton(LdesStore,)
+        ldes_client = providers.Factory(LdesClient, http_pool=ldes_http_pool, rate_limiter=ldes_rate_limiter, metrics=ldes_metrics,
+            stream_threshold=config.sync.stream_threshold, circuit_breaker=ldes_circuit_breaker, max_retries=config.sync.max_retries,
+            retry_backoff=config.sync.retry_backoff, max_retry_delay=config.sync.max_retry_delay),
+        ldes_store = providers.Singleton(LdesStore, codec=config.storage.codec),
+        max_workers = config.sync.max_workers,
+        max_per_host = config.sync.max_per_host,
+        max_poll_interval = config.sync.max_poll_interval,
+        gc_interval = config.sync.gc_interval,
+        metrics = ldes_metrics,
+        metrics_file = config.metrics.file,
+        ldes_emitters = providers.Callable(create_emitters, config.emitters)
     )
 
+    ldes_store_factory = providers.Factory(LdesStore, codec=config.storage.codec)
+
+    ldes_daemon_factory = providers.Factory(
+        LdesDaemon,
+        max_concurrent_syncs = config.serve.max_concurrent_syncs
+    )
@@ -2,9 +2,11 @@ import sys
 import traceback
 import argparse
 from argparse import Namespace
+from typing import List
 from ldes_client_error import LdesClientError
 from dependency_injector.wiring import inject, Provide
 from container import Container
+from services import discover_aliases, send_daemon_command
 
 
 def configure_arg_parser() -> Namespace:
@@ -17,6 +19,13 @@ def configure_arg_parser() -> Namespace:
     # stop sync command
     parser_start = subparsers.add_parser('stop', help='Stop synchronizing a previously onboarded LDES collection with given alias.')
     parser_start.add_argument('alias', help='The alias of the LDES view/collection.')
+    # serve command
+    subparsers.add_parser('serve', help='Start a daemon synchronizing all onboarded LDES collections.')
+    # pause/resume commands
+    parser_pause = subparsers.add_parser('pause', help='Pause synchronizing the LDES collection with given alias in the running daemon.')
+    parser_pause.add_argument('alias', help='The alias of the LDES view/collection.')
+    parser_resume = subparsers.add_parser('resume', help='Resume synchronizing the paused or stopped LDES collection with given alias in the running daemon.')
+    parser_resume.add_argument('alias', help='The alias of the LDES view/collection.')
     # status command
     parser_status = subparsers.add_parser('status', help='Displays the sync status of an LDES collection with given alias.')
     parser_status.add_argument('alias', help='The alias of the LDES view/collection.', nargs='*')
@@ -28,23 +37,152 @@ def configure_arg_parser() -> Namespace:
     parser_onboard.add_argument('location', help='The URL of the LDES view/collection.')
     parser_onboard.add_argument('alias', help='The alias of the LDES view/collection.')
     parser_onboard.add_argument('--polling', default='60', type=int, help='The polling interval in seconds.')
+    parser_onboard.add_argument('--filter-path', default=None, help='The path of the member values to filter on, defaults to the timestamp path of the stream.')
+    parser_onboard.add_argument('--min-value', default=None, help='Only crawl the subtrees that can hold members with a filter path value of at least this value.')
+    parser_onboard.add_argument('--max-value', default=None, help='Only crawl the subtrees that can hold members with a filter path value of at most this value.')
+    parser_onboard.add_argument('--prefix', default=None, help='Only crawl the subtrees that can hold members with a filter path value starting with this prefix.')
+    parser_onboard.add_argument('--retention-period', default=None, help='Only keep the members of this period (an xsd:duration like P30D), instead of following the retention policies of the view.')
+    parser_onboard.add_argument('--retention-versions', default=None, type=int, help='Only keep this number of latest versions per entity, instead of following the retention policies of the view.')
+    parser_onboard.add_argument('--no-retention', action='store_true', help='Keep all members, ignoring the retention policies of the view.')
+    parser_onboard.add_argument('--accept', default=None, help='The Accept header the fragments are requested with, e.g. "application/n-quads, text/turtle;q=0.5". Defaults to preferring N-Triples and N-Quads.')
+    # changes command
+    parser_changes = subparsers.add_parser('changes', help='Writes the members received since a cursor as N-Triples to stdout.')
+    parser_changes.add_argument('alias', help='The alias of the LDES view/collection.')
+    parser_changes.add_argument('--since', default=None, type=int, help='The cursor (member sequence number) after which to start, defaults to the consumer cursor or the start.')
+    parser_changes.add_argument('--consumer', default=None, help='The name of a consumer whose cursor is read and advanced in the alias database.')
+    # compact command
+    parser_compact = subparsers.add_parser('compact', help='Compresses the stored payloads of an LDES collection with given alias and reclaims the freed space.')
+    parser_compact.add_argument('alias', help='The alias of the LDES view/collection.')
+    parser_compact.add_argument('--codec', default=None, choices=['none', 'zlib', 'zstd', 'zstd-dict'], help='The payload codec, defaults to the storage codec in the configuration.')
+    parser_compact.add_argument('--dictionary', action='store_true', help='Train a zstd dictionary on the payloads of the collection first.')
+    # gc command
+    parser_gc = subparsers.add_parser('gc', help='Deletes the members and fragments of an LDES collection with given alias that fell out of its retention window.')
+    parser_gc.add_argument('alias', help='The alias of the LDES view/collection.')
+    # export command
+    parser_export = subparsers.add_parser('export', help='Writes the stored members of an LDES collection with given alias to a file or stdout.')
+    parser_export.add_argument('alias', help='The alias of the LDES view/collection.')
+    parser_export.add_argument('--format', default='nquads', choices=['nquads', 'ndjson', 'jsonld', 'parquet'], help='The export format, JSON-LD members are framed with the pyldes:memberFrameSpec of the view.')
+    parser_export.add_argument('--output', default=None, help='The output file, defaults to stdout (not for parquet).')
+    parser_export.add_argument('--since', default=0, type=int, help='The cursor (member sequence number) after which to start.')
+    parser_export.add_argument('--workers', default=1, type=int, help='The number of processes encoding the members.')
+    # snapshot command
+    parser_snapshot = subparsers.add_parser('snapshot', help='Writes the latest version of every entity (or of a single one) of an LDES collection with given alias.')
+    parser_snapshot.add_argument('alias', help='The alias of the LDES view/collection.')
+    parser_snapshot.add_argument('--entity', default=None, help='The IRI of a single entity (the object of its ldes:versionOfPath) to look up.')
+    parser_snapshot.add_argument('--format', default='nquads', choices=['nquads', 'ndjson', 'jsonld', 'parquet'], help='The export format of the snapshot.')
+    parser_snapshot.add_argument('--output', default=None, help='The output file, defaults to stdout (not for parquet).')
+    parser_snapshot.add_argument('--workers', default=1, type=int, help='The number of processes encoding the members.')
     return parser
 
 def onboard_ldes(
         alias: str,
         location: str,
-        polling: int = 60
+        polling: int = 60,
+        filter_path: str = None,
+        min_value: str = None,
+        max_value: str = None,
+        prefix: str = None,
+        retention_period: str = None,
+        retention_versions: int = None,
+        no_retention: bool = False,
+        accept: str = None
     ):
     ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store__location=container.config.storage.location(),ldes_store__alias=alias)
-    ldes_manager.onboard_ldes_view(alias, location, polling)
+    ldes_manager.onboard_ldes_view(alias, location, polling, filter_path, min_value, max_value, prefix, retention_period, retention_versions, no_retention, accept)
 
 def sync_ldes(alias: str):
     ldes_syncer = container.ldes_syncer_factory(alias=alias, ldes_store__location=container.config.storage.location(), ldes_store__alias=alias)
+    serve_metrics()
     ldes_syncer.sync()
 
 def stop_sync_ldes(alias: str):
-    ldes_syncer = container.ldes_syncer_factory(alias=alias, ldes_store__location=container.config.storage.location(), ldes_store__alias=alias)
-    ldes_syncer.stop_sync()
+    # a collection synced by the daemon is stopped through its control socket, otherwise (no daemon is running, or it does not
+    # ... sync the collection) the flag is picked up by the sync process, and keeps the daemon from syncing the collection
+    location = container.config.storage.location()
+    if send_daemon_command(location, f'stop {alias}') != 'ok':
+        ldes_syncer = container.ldes_syncer_factory(alias=alias, ldes_store__location=location, ldes_store__alias=alias)
+        ldes_syncer.stop_sync()
+
+def resume_sync_ldes(alias: str):
+    # a stopped collection is synced again by the running daemon, or else by the next daemon that is started
+    if command_daemon(f'resume {alias}', required=False) is None:
+        ldes_syncer = container.ldes_syncer_factory(alias=alias, ldes_store__location=container.config.storage.location(), ldes_store__alias=alias)
+        ldes_syncer.resume_sync()
+
+def serve_ldes():
+    location = container.config.storage.location()
+    ldes_daemon = container.ldes_daemon_factory(
+        location=location,
+        syncer_factory=lambda alias: container.ldes_syncer_factory(alias=alias, ldes_store=container.ldes_store_factory(location=location, alias=alias)))
+    serve_metrics()
+    ldes_daemon.serve()
+
+def serve_metrics():
+    port = container.config.metrics.port()
+    if port:
+        container.ldes_metrics().serve(port)
+
+def status_ldes(aliases: List[str]):
+    location = container.config.storage.location()
+    # the daemon reports which collections it is syncing right now
+    daemon_states = dict(state.split(':', 1) for state in (send_daemon_command(location, 'status') or '').split() if ':' in state)
+    aliases = aliases or discover_aliases(location)
+    for alias in aliases:
+        # the store of the manager factory is a singleton, every alias gets its own store like in serve_ldes()
+        ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store=container.ldes_store_factory(location=location, alias=alias))
+        status = ldes_manager.report_ldes_view_status()
+        print(f'{alias}:')
+        if not status:
+            print('  not onboarded')
+            continue
+        status['daemon'] = daemon_states.get(alias, 'not served')
+        consumers = status.pop('consumers')
+        for key, value in status.items():
+            print(f'  {key}: {value}')
+        for consumer, seq in consumers.items():
+            print(f'  consumer {consumer}: at {seq}, {status["last_seq"] - seq} members behind')
+
+def command_daemon(command: str, required: bool = True) -> str:
+    reply = send_daemon_command(container.config.storage.location(), command)
+    if reply is None and required:
+        raise LdesClientError('No LDES daemon is running, start one with: ldes serve')
+    if reply and reply.startswith('error:'):
+        raise LdesClientError(reply[len('error:'):].strip())
+    return reply
+
+def changes_ldes(alias: str, since: int = None, consumer: str = None):
+    ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store__location=container.config.storage.location(),ldes_store__alias=alias)
+    cursor = since
+    for member in ldes_manager.iter_ldes_changes(since, consumer):
+        sys.stdout.write(member.payload)
+        cursor = member.seq
+    if cursor is not None:
+        print(f'Next cursor: {cursor}', file=sys.stderr)
+
+def gc_ldes(alias: str):
+    ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store__location=container.config.storage.location(),ldes_store__alias=alias)
+    members, nodes = ldes_manager.collect_ldes_garbage()
+    print(f'Deleted {members} expired members, and deleted or emptied {nodes} fragments.')
+
+def compact_ldes(alias: str, codec: str = None, dictionary: bool = False):
+    ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store__location=container.config.storage.location(),ldes_store__alias=alias)
+    ldes_manager.compact_ldes_view(codec, dictionary)
+
+def export_ldes(alias: str, export_format: str = 'nquads', output: str = None, since: int = 0, workers: int = 1):
+    ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store__location=container.config.storage.location(),ldes_store__alias=alias)
+    count = ldes_manager.export_ldes_view(export_format, output, since, workers)
+    print(f'Exported {count} members.', file=sys.stderr)
+
+def snapshot_ldes(alias: str, entity: str = None, export_format: str = 'nquads', output: str = None, workers: int = 1):
+    ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store__location=container.config.storage.location(),ldes_store__alias=alias)
+    if entity:
+        member = ldes_manager.get_ldes_entity(entity)
+        if not member:
+            raise LdesClientError(f'No version of entity {entity} was stored.')
+        sys.stdout.write(member.payload)
+    else:
+        count = ldes_manager.snapshot_ldes_view(export_format, output, workers)
+        print(f'Exported {count} entities.', file=sys.stderr)
 
 def delete_ldes(alias: str):
     ldes_manager = container.ldes_manager_factory(alias=alias, ldes_store__location=container.config.storage.location(),ldes_store__alias=alias)
@@ -57,19 +195,41 @@ if __name__ == '__main__':
     container = Container()
     try:
         if cl_args.command == 'sync':
-            print (f'Starting LDES client for view or subset {cl_args.alias}.')
+            print (f'Starting LDES client for view or subset {cl_args.alias}.', file=sys.stderr)
             sync_ldes(cl_args.alias)
-        if cl_args.command == 'stop':
+        elif cl_args.command == 'serve':
+            print ('Starting LDES daemon for all onboarded views and subsets.', file=sys.stderr)
+            serve_ldes()
+        elif cl_args.command == 'pause':
+            print (f'Pausing view or subset {cl_args.alias}.')
+            command_daemon(f'pause {cl_args.alias}')
+        elif cl_args.command == 'resume':
+            print (f'Resuming view or subset {cl_args.alias}.')
+            resume_sync_ldes(cl_args.alias)
+        elif cl_args.command == 'stop':
             print (f'Stop syncing view or subset {cl_args.alias}.')
             stop_sync_ldes(cl_args.alias)
         elif cl_args.command == 'onboard':
             print (f'Onboarding LDES view or subset {cl_args.location} as {cl_args.alias} with polling interval {cl_args.polling}.')
-            onboard_ldes(cl_args.alias, cl_args.location, cl_args.polling)
+            onboard_ldes(cl_args.alias, cl_args.location, cl_args.polling, cl_args.filter_path, cl_args.min_value, cl_args.max_value, cl_args.prefix,
+                cl_args.retention_period, cl_args.retention_versions, cl_args.no_retention, cl_args.accept)
         elif cl_args.command == 'delete':
             print (f'Deleting LDES view or subset with alias {cl_args.alias}.')
             delete_ldes(cl_args.alias)
+        elif cl_args.command == 'changes':
+            changes_ldes(cl_args.alias, cl_args.since, cl_args.consumer)
+        elif cl_args.command == 'compact':
+            print (f'Compacting LDES view or subset with alias {cl_args.alias}.')
+            compact_ldes(cl_args.alias, cl_args.codec, cl_args.dictionary)
+        elif cl_args.command == 'gc':
+            print (f'Deleting the expired members of view or subset with alias {cl_args.alias}.')
+            gc_ldes(cl_args.alias)
+        elif cl_args.command == 'export':
+            export_ldes(cl_args.alias, cl_args.format, cl_args.output, cl_args.since, cl_args.workers)
+        elif cl_args.command == 'snapshot':
+            snapshot_ldes(cl_args.alias, cl_args.entity, cl_args.format, cl_args.output, cl_args.workers)
         elif cl_args.command == 'status':
-            print (f'Getting LDES status for view or subset {cl_args.alias} ... .')
+            status_ldes(cl_args.alias)
     except LdesClientError as error:
         print(error, file=sys.stderr)
         traceback.print_exc()
@@ -1,3 +1,4 @@
 from models.ldes_node import LdesNode
 from models.ldes_view import LdesView
 from models.ldes_relation import LdesRelation
+from models.ldes_member import LdesMember
@@ -0,0 +1,24 @@
+import datetime
+
+class LdesMember():
+    __slots__ = ('uri', 'node_uri', 'version_of', 'timestamp', 'payload', 'seq')
+
+    def __init__(self, member_uri: str, node_uri: str, version_of: str = None, timestamp: datetime.datetime = None, payload: str = None, seq: int = None):
+        self.uri = member_uri
+        self.node_uri = node_uri
+        self.version_of = version_of
+        self.timestamp = timestamp
+        self.payload = payload
+        # position of the member in the order in which the store received it, assigned by the store
+        self.seq = seq
+
+    def to_tuple(self):
+        return (self.uri, self.node_uri, self.version_of, self.timestamp, self.payload, self.seq)
+
+    def __str__(self):
+        return f"""<LdesMember \
+uri='{self.uri}' \
+node_uri='{self.node_uri}' \
+version_of='{self.version_of}' \
+timestamp='{self.timestamp}' \
+seq={self.seq}>"""
@@ -1,8 +1,12 @@
 import datetime
 
 class LdesNode():
+    # slotted, as the syncer walks through (pages of) hundreds of thousands of nodes every polling cycle
+    __slots__ = ('uri', 'view_uri', 'location', '_payload', 'etag', 'expires', 'immutable', 'next_poll', 'poll_interval',
+        'last_modified', 'content_hash', 'content_type', 'members')
 
-    def __init__(self, node_uri: str, node_location: str, view_uri: str, node_payload:str, etag: str=None, expires: datetime.datetime=None, immutable = False):
+    def __init__(self, node_uri: str, node_location: str, view_uri: str, node_payload:str, etag: str=None, expires: datetime.datetime=None, immutable = False, next_poll: datetime.datetime=None, poll_interval: int=None,
+            last_modified: str=None, content_hash: str=None, content_type: str=None):
         self.uri = node_uri
         self.view_uri = view_uri
         self.location = node_location
@@ -10,7 +14,28 @@ class LdesNode():
         self.etag = etag
         self.expires = expires
         self.immutable = immutable
+        # adaptive polling schedule: when the node is polled next and the interval that deadline was based on
+        self.next_poll = next_poll
+        self.poll_interval = poll_interval
+        # validators of the last response: its Last-Modified header (as received) and a hash of its body, see LdesClient.get_ldes_node()
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        # the format the payload was received in, as negotiated with the server
+        self.content_type = content_type
+        # members found in the fetched fragment (an iterator for spooled fragments), these are stored separately and not part of to_tuple()
+        self.members = []
     
+    @property
+    def payload(self) -> str:
+        # nodes read from the store carry a loader instead of their payload, which is only read when it is used
+        if callable(self._payload):
+            self._payload = self._payload()
+        return self._payload
+
+    @payload.setter
+    def payload(self, payload):
+        self._payload = payload
+
     def to_tuple(self):
         return (self.uri, self.location, self.view_uri, self.payload, self.etag, self.expires, self.immutable)
 
@@ -1,5 +1,6 @@
 
 class LdesRelation():
+    __slots__ = ('source_node', 'relation_type', 'target_location', 'target_node_uri', 'is_processed', 'path', 'value', 'value_datatype')
 
     def __init__(
         self,
@@ -8,12 +9,19 @@ class LdesRelation():
         target_loaction: str, 
         target_node_uri: str,
         is_processed: bool,
+        path: str = None,
+        value: str = None,
+        value_datatype: str = None,
     ):
         self.source_node = source_node
         self.relation_type = relation_type
         self.target_location = target_loaction
         self.target_node_uri = target_node_uri
         self.is_processed = is_processed
+        # tree:path and tree:value (lexical form and datatype IRI) of the relation, used to prune the crawl
+        self.path = path
+        self.value = value
+        self.value_datatype = value_datatype
     
     def to_tuple(self):
         return (
@@ -21,11 +29,16 @@ class LdesRelation():
             self.relation_type,
             self.target_location, 
             self.target_node_uri,
-            self.is_processed)
+            self.is_processed,
+            self.path,
+            self.value,
+            self.value_datatype)
     
     def __str__(self):
         return f"""<LdesRelation source_node='{self.source_node}' \
 relation_type='{self.relation_type}' \
 tagret_location='{self.target_location}' \
 target_node_uri='{self.target_node_uri}' \
-is_processed={self.is_processed}>"""
\ No newline at end of file
+is_processed={self.is_processed} \
+path='{self.path}' \
+value='{self.value}'>"""
\ No newline at end of file
@@ -1,15 +1,40 @@
 
 class LdesView():
+    __slots__ = ('uri', 'location', 'alias', 'polling', 'sync', 'version_of_path', 'timestamp_path',
+        'filter_path', 'filter_min', 'filter_max', 'filter_prefix', 'member_frame', 'retention_period', 'retention_versions', 'accept', 'stopped')
 
-    def __init__(self,  view_uri: str, view_location: str, view_alias: str, polling: int = 60, sync: bool = False):
+    def __init__(self,  view_uri: str, view_location: str, view_alias: str, polling: int = 60, sync: bool = False, version_of_path: str = None, timestamp_path: str = None,
+            filter_path: str = None, filter_min: str = None, filter_max: str = None, filter_prefix: str = None,
+            member_frame: str = None, retention_period: str = None, retention_versions: int = None, accept: str = None,
+            stopped: bool = False):
         self.uri = view_uri
         self.location = view_location
         self.alias = view_alias
         self.polling = polling
         self.sync = sync
+        # ldes:versionOfPath and ldes:timestampPath of the event stream the view belongs to
+        self.version_of_path = version_of_path
+        self.timestamp_path = timestamp_path
+        # the values of filter_path the synced members are restricted to, subtrees outside of them are not crawled
+        self.filter_path = filter_path
+        self.filter_min = filter_min
+        self.filter_max = filter_max
+        self.filter_prefix = filter_prefix
+        # pyldes:memberFrameSpec of the view description, the JSON-LD frame members are exported with
+        self.member_frame = member_frame
+        # retention policies: members are kept for retention_period (an xsd:duration) and/or as one of the retention_versions
+        # ... latest versions of their entity, read from the ldes:retentionPolicy of the view unless overridden when onboarding
+        self.retention_period = retention_period
+        self.retention_versions = retention_versions
+        # the Accept header the fragments of the view are requested with, the client's default preferences when None
+        self.accept = accept
+        # a view stopped on request is not synced again until a sync or resume is asked for explicitly, not even by the daemon
+        self.stopped = stopped
         
     def to_tuple(self):
-        return (self.uri, self.location, self.alias, self.polling, self.sync)
+        return (self.uri, self.location, self.alias, self.polling, self.sync, self.version_of_path, self.timestamp_path,
+            self.filter_path, self.filter_min, self.filter_max, self.filter_prefix,
+            self.member_frame, self.retention_period, self.retention_versions, self.accept, self.stopped)
 
     def __str__(self):
         return f"<LdesView \
@@ -2,3 +2,9 @@ from services.ldes_manager import LdesManager
 from services.ldes_syncer import LdesSyncer
 from services.ldes_client import LdesClient
 from services.ldes_store import LdesStore
+from services.ldes_http_pool import LdesHttpPool
+from services.ldes_scheduler import LdesPollingPolicy, LdesRateLimiter, LdesCircuitBreaker
+from services.ldes_metrics import LdesMetrics
+from services.ldes_emitter import LdesEmitter, LdesEmitterDispatcher, create_emitters
+from services.ldes_exporter import LdesExporter
+from services.ldes_daemon import LdesDaemon, discover_aliases, send_daemon_command
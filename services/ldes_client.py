@@ -1,70 +1,299 @@
+import datetime
+import hashlib
 import http.client
-from typing import List, Tuple
+import random
+import sys
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterable, Iterator, List, Tuple
 from urllib.parse import urlparse
 from models import LdesNode, LdesView
 from ldes_client_error import LdesClientError
+from services.ldes_http_pool import LdesHttpPool
+from services.ldes_ntriples import NTriplesIndex, NTriplesSpool
+from services.ldes_scheduler import LdesRateLimiter, LdesCircuitBreaker
+from services.ldes_metrics import LdesMetrics
 
 from rdflib import Graph, Literal, RDF, URIRef
 from rdflib.namespace import DCAT, DCTERMS, DCMITYPE, SOSA
 from namespace import LDES, TREE, PYLDES
-from models  import LdesRelation
+from models  import LdesRelation, LdesMember
+
+
+# formats read line by line by the NTriplesIndex instead of being parsed into an rdflib graph
+LINE_BASED_FORMATS = {'application/n-triples', 'application/n-quads', 'text/plain'}
+
+# the formats asked for when a view has no Accept preferences of its own, the line based ones are by far the fastest to read
+DEFAULT_ACCEPT = 'application/n-triples, application/n-quads, text/turtle;q=0.9, application/ld+json;q=0.8, application/rdf+xml;q=0.5, */*;q=0.1'
+
+# rdflib parser of the other response content types, anything unknown is assumed to be turtle
+RDF_FORMATS = {
+    'text/turtle': 'turtle',
+    'application/x-turtle': 'turtle',
+    'application/trig': 'trig',
+    'text/n3': 'n3',
+    'application/rdf+xml': 'xml',
+    'application/ld+json': 'json-ld',
+    'application/json': 'json-ld',
+}
+
+# responses of a host asking to be polled again later, honoured through their Retry-After header
+RETRY_LATER_STATUSES = {429, 503}
+
+# responses and errors of a host that may well succeed when the request is retried
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = (OSError, http.client.HTTPException)
+
+
+def hash_content(chunks: Iterable[bytes], content_hash) -> Iterator[bytes]:
+    """Passes the chunks of a response body through, feeding them to content_hash on the way."""
+    for chunk in chunks:
+        content_hash.update(chunk)
+        yield chunk
 
 
 class LdesClient():
 
-    def __init__(self):
-        pass
+    def __init__(self, http_pool: LdesHttpPool = None, rate_limiter: LdesRateLimiter = None, metrics: LdesMetrics = None, stream_threshold: int = 0,
+            circuit_breaker: LdesCircuitBreaker = None, max_retries: int = 3, retry_backoff: float = 1.0, max_retry_delay: float = 60):
+        # the pool is shared by all requests (and threads) of a client, so connections are kept alive across a sync cycle
+        self.http_pool = http_pool if http_pool else LdesHttpPool()
+        # the rate limiter is shared by all clients, so that the hosts are paced across the synced streams
+        self.rate_limiter = rate_limiter if rate_limiter else LdesRateLimiter()
+        # fetches are counted and timed per host
+        self.metrics = metrics if metrics else LdesMetrics()
+        # line based fragments of more than stream_threshold characters are spooled to disk, and their members streamed (0 never spools)
+        self.stream_threshold = stream_threshold
+        # the circuit breaker is shared by all clients as well, a failing host is parked for all streams it serves
+        self.circuit_breaker = circuit_breaker if circuit_breaker else LdesCircuitBreaker()
+        # transient failures are retried max_retries times, waiting from retry_backoff seconds doubling up to max_retry_delay
+        self.max_retries = max_retries or 0
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
 
-    def get_ldes_view(self, location: str) -> LdesView:
+    def get_ldes_view(self, location: str, accept: str = None) -> LdesView:
+        """Fetches the view at location, requesting it with the given Accept header (see DEFAULT_ACCEPT)."""
         try:
-            url = urlparse(location)
-            conn = http.client.HTTPConnection(url.hostname, url.port)
-            headers = {'Accept': 'text/turtle'}
-            conn.request('GET', url.path, headers=headers)
-            response = conn.getresponse().read().decode()
-            g = Graph()
-            g.parse(data=response, format='turtle')
-            return self.rdf_to_view(location, g)
+            headers = {'Accept': accept or DEFAULT_ACCEPT}
+            self.rate_limiter.acquire(location)
+            with self.http_pool.request('GET', location, headers) as response:
+                content_type = self.get_content_type(response)
+                if content_type in LINE_BASED_FORMATS:
+                    g = NTriplesIndex.from_chunks(response.iter_chunks()).structural_graph()
+                else:
+                    g = Graph()
+                    g.parse(data=response.read().decode(), format=RDF_FORMATS.get(content_type, 'turtle'))
+            the_view = self.rdf_to_view(location, g)
+            the_view.accept = accept
+            return the_view
         except Exception as error:
             raise LdesClientError(f"Failed to get the view from {location}. {error}", error)
 
-    def get_ldes_node(self, location: str, etag: str = None) -> Tuple[bool, LdesNode, List[LdesRelation]]:
+    def get_ldes_node(self, location: str, etag: str = None, view: LdesView = None, last_modified: str = None, 
+            content_hash: str = None) -> Tuple[bool, LdesNode, List[LdesRelation]]:
+        """Fetches the node at location, conditionally when the validators of a previous response are given.
+
+        Returns (True, node, relations) when the node changed, and (False, node, None) when the server
+        confirmed the given etag or last_modified with a 304, or sent a body with the given content_hash
+        (servers without validators), in which case the node only carries refreshed validators and cache metadata.
+        A host asking to retry later (429 or 503 with Retry-After) is not requested until then, meanwhile its
+        nodes are reported as unchanged with an expiry set to the time they may be retried. Transient failures (timeouts,
+        connection errors, 5xx and 429 without Retry-After) are retried with exponential backoff, and count towards the
+        circuit breaker of the host once the retries are exhausted. The node is then reported as unchanged as well, like
+        the nodes of a host that is parked by the circuit breaker and the nodes answered with any other status.
+        The members of a changed node are extracted using the version and timestamp paths of the given view,
+        unless the fragment describes its event stream itself.
+        """
+        host = urlparse(location).netloc
         try:
-            url = urlparse(location)
-            conn = http.client.HTTPConnection(url.hostname, url.port)
-            headers = {'Accept': 'text/turtle'}
+            # the circuit breaker is only consulted for hosts that are not deferred, it may hand out the probe of the host
+            delay = self.rate_limiter.get_delay(location) or self.circuit_breaker.get_delay(location)
+            if delay:
+                self.metrics.inc('fragments', host=host, status='deferred')
+                return False, self.retry_later_node(location, etag, delay, last_modified, content_hash), None
+            headers = {'Accept': view.accept if view and view.accept else DEFAULT_ACCEPT}
             if etag: headers['If-None-Match'] = etag
-            conn.request('GET', f'{url.path}?{url.query}', headers=headers)
-            response = conn.getresponse()
-            # if an If-None-Match header with a previously recived etag (see above) is responded to with 304, 
-            # ... then the node is already up to date in our records, report back as unchanged
-            if response.status == 304:
-                return False, None, None
-            elif response.status == 200:
-                response_headers = self.headers_to_dict(response.headers.items())
-                cache_control = response_headers['Cache-Control'] if 'Cache-Control' in response_headers.keys() else None
-                # TODO: control cache expiration with cahce_control
-                etag = response_headers['Etag'] if 'Etag' in response_headers.keys() else None
-                response_data = response.read().decode()
-                g = Graph()
-                g.parse(data=response_data, format='turtle')
-                the_node =  self.rdf_to_node(location, g)
+            if last_modified: headers['If-Modified-Since'] = last_modified
+            # the probe of a parked host is not retried, its failure parks the host again right away
+            retries = 0 if self.circuit_breaker.is_probing(location) else self.max_retries
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(self.get_backoff(attempt))
+                self.rate_limiter.acquire(location)
+                try:
+                    # line based formats are parsed while they are downloaded, so their parse time is part of the fetch
+                    with self.metrics.span('fetch', host=host), self.http_pool.request('GET', location, headers) as response:
+                        self.metrics.inc('fragments', host=host, status=response.status, description='Fragment requests per host and response status.')
+                        if response.status in TRANSIENT_STATUSES and not (response.status in RETRY_LATER_STATUSES and self.get_retry_after(response) is not None):
+                            failure = f'{response.status}: {response.reason}'
+                            continue
+                        # the host answered, whatever it answered does not count as a failure
+                        self.circuit_breaker.record_success(location)
+                        expires, immutable = self.get_cache_expiry(response)
+                        # if an If-None-Match header with a previously recived etag (see above) is responded to with 304, 
+                        # ... then the node is already up to date in our records, report back as unchanged
+                        if response.status == 304:
+                            return False, LdesNode(None, location, None, None, etag, expires, immutable, last_modified=last_modified, content_hash=content_hash), None
+                        elif response.status == 200:
+                            response_etag = response.getheader('ETag')
+                            response_last_modified = response.getheader('Last-Modified')
+                            content_type = self.get_content_type(response)
+                            body_hash = hashlib.blake2b(digest_size=16)
+                            if content_type in LINE_BASED_FORMATS:
+                                # line based formats are indexed while they are downloaded, very large ones on disk
+                                index = NTriplesIndex.from_chunks(hash_content(response.iter_chunks(), body_hash), self.stream_threshold)
+                            else:
+                                index = None
+                                response_data = response.read()
+                                body_hash.update(response_data)
+                            self.metrics.inc('received_bytes', response.bytes_read, host=host, description='Fragment body bytes received, before decompression.')
+                            # a body identical to the previous one is not parsed again, even when the server sent no validators
+                            if content_hash and body_hash.hexdigest() == content_hash:
+                                self.metrics.inc('unchanged_bodies', host=host, description='Fragment bodies received identical to the stored ones.')
+                                if isinstance(index, NTriplesSpool):
+                                    index.close()
+                                return False, LdesNode(None, location, None, None, response_etag, expires, immutable, last_modified=response_last_modified, 
+                                    content_hash=content_hash), None
+                            etag, last_modified = response_etag, response_last_modified
+                            break
+                        elif response.status in RETRY_LATER_STATUSES:
+                            delay = self.get_retry_after(response)
+                            print(f"WARNING: {location} asked to retry after {delay}s ({response.status}: {response.reason})", file=sys.stderr)
+                            self.rate_limiter.defer(location, delay)
+                            return False, self.retry_later_node(location, etag, delay, last_modified, content_hash), None
+                        else:
+                            # the node is polled again later like an unchanged one, a relation to it stays pending
+                            print(f"WARNING: Unexpected HTTP response {response.status}: {response.reason} from {location}", file=sys.stderr)
+                            return False, self.retry_later_node(location, etag, 0, last_modified, content_hash), None
+                except TRANSIENT_ERRORS as error:
+                    self.metrics.inc('fragments', host=host, status='error')
+                    failure = f'{type(error).__name__}: {error}'
+            else:
+                cooldown = self.circuit_breaker.record_failure(location)
+                print(f"WARNING: Failed to get the node at {location} after {attempt + 1} attempts ({failure})", file=sys.stderr)
+                if cooldown:
+                    print(f"WARNING: {host} keeps failing, it is not requested for {cooldown}s", file=sys.stderr)
+                self.metrics.inc('failed_fragments', host=host, description='Fragment requests that failed after their retries.')
+                return False, self.retry_later_node(location, etag, cooldown, last_modified, content_hash), None
+            with self.metrics.span('parse', host=host):
+                if index:
+                    g = index.structural_graph(view.version_of_path if view else None, view.timestamp_path if view else None)
+                    payload = index.payload
+                    member_payload = index.cbd
+                else:
+                    # the payload is stored as received, the graph is only used to look up the node, relations and members
+                    payload = response_data.decode()
+                    g = Graph()
+                    g.parse(data=payload, format=RDF_FORMATS.get(content_type, 'turtle'))
+                    member_payload = None
+                the_node =  self.rdf_to_node(location, g, payload)
                 the_node.etag = etag
+                the_node.last_modified = last_modified
+                the_node.content_hash = body_hash.hexdigest()
+                the_node.content_type = content_type
+                the_node.expires = expires
+                the_node.immutable = immutable
+                if isinstance(index, NTriplesSpool):
+                    # the members of a spooled fragment are read while they are stored, see LdesSyncer.handle_node()
+                    self.metrics.inc('spooled_fragments', host=host, description='Fragments too large to be held in memory, spooled to disk.')
+                    the_node.members = self.iter_spooled_members(the_node.uri, index, view)
+                else:
+                    the_node.members = self.rdf_get_node_members(the_node.uri, g, view, member_payload)
                 relations = self.rdf_get_node_relations(the_node.uri, g)
-                return True, the_node, relations
-            else:
-                print(f"WARNING: Unexpeted HTTP response {response.status}: {response.reason}")
+            return True, the_node, relations
             
         except Exception as error:
+            self.metrics.inc('fragments', host=host, status='error')
             raise LdesClientError(f"Failed to get the node at {location}. {error}")
+        finally:
+            # a probe that neither succeeded nor failed (e.g. a fragment that could not be parsed) is handed to the next request
+            self.circuit_breaker.release_probe(location)
+
+    def get_content_type(self, response) -> str:
+        """Returns the media type of a response without its parameters, responses without one are assumed to be Turtle."""
+        return (response.getheader('Content-Type') or 'text/turtle').split(';')[0].strip().lower()
+
+    def get_cache_expiry(self, response) -> Tuple[datetime.datetime, bool]:
+        """Derives the (UTC) expiry and immutability of a response from its Cache-Control, Age and Expires headers."""
+        directives = {}
+        for directive in (response.getheader('Cache-Control') or '').split(','):
+            name, _, value = directive.strip().partition('=')
+            if name:
+                directives[name.lower()] = value.strip('"')
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if 'no-cache' in directives or 'no-store' in directives:
+            return now, False
+        immutable = 'immutable' in directives
+        if 'max-age' in directives:
+            try:
+                age = int(response.getheader('Age') or 0)
+                return now + datetime.timedelta(seconds=int(directives['max-age']) - age), immutable
+            except ValueError:
+                pass
+        expires = response.getheader('Expires')
+        if expires:
+            try:
+                expires = parsedate_to_datetime(expires)
+                return (expires if expires.tzinfo else expires.replace(tzinfo=datetime.timezone.utc)), immutable
+            except (TypeError, ValueError):
+                # an invalid Expires value means the response is already stale
+                return now, immutable
+        return None, immutable
+
+    def get_retry_after(self, response) -> float:
+        """Returns the number of seconds of the Retry-After header (in seconds or as HTTP date) of a response."""
+        retry_after = (response.getheader('Retry-After') or '').strip()
+        if not retry_after:
+            return None
+        if retry_after.isdigit():
+            return float(retry_after)
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        retry_at = retry_at if retry_at.tzinfo else retry_at.replace(tzinfo=datetime.timezone.utc)
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+    def get_backoff(self, attempt: int) -> float:
+        """Returns the seconds to wait before the given retry, doubling from retry_backoff up to max_retry_delay.
+
+        The jitter spreads the retries of the concurrent fetches of a host, so that they do not hit it at the same time.
+        """
+        delay = min(self.max_retry_delay, self.retry_backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def retry_later_node(self, location: str, etag: str, delay: float, last_modified: str = None, content_hash: str = None) -> LdesNode:
+        expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay)
+        return LdesNode(None, location, None, None, etag, expires, False, last_modified=last_modified, content_hash=content_hash)
 
     def rdf_to_view(self, location: str, g: Graph) -> LdesView:
         view_description_ref = g.value(predicate=RDF.type, object=TREE.ViewDescription)
         view_alias = g.value(view_description_ref, PYLDES.alias)
-        return LdesView(view_description_ref, location, view_alias)
+        member_frame = g.value(view_description_ref, PYLDES.memberFrameSpec)
+        retention_period, retention_versions = self.rdf_get_retention_policies(g)
+        stream_ref = g.value(predicate=RDF.type, object=LDES.EventStream)
+        version_of_path = g.value(stream_ref, LDES.versionOfPath) if stream_ref else None
+        timestamp_path = g.value(stream_ref, LDES.timestampPath) if stream_ref else None
+        return LdesView(view_description_ref, location, view_alias, 
+            version_of_path=str(version_of_path) if version_of_path else None, 
+            timestamp_path=str(timestamp_path) if timestamp_path else None,
+            member_frame=str(member_frame) if member_frame else None,
+            retention_period=retention_period, retention_versions=retention_versions)
 
-    def rdf_to_node(self, location:str, g: Graph) -> LdesNode:
-        payload = g.serialize(format='turtle')
+    def rdf_get_retention_policies(self, g: Graph) -> Tuple[str, int]:
+        """Returns the duration of the ldes:DurationAgoPolicy and the amount of the ldes:LatestVersionSubset the view is subject to."""
+        retention_period, retention_versions = None, None
+        for policy_ref in g.objects(None, LDES.retentionPolicy):
+            policy_type = g.value(policy_ref, RDF.type)
+            if policy_type == LDES.DurationAgoPolicy and g.value(policy_ref, TREE.value):
+                retention_period = str(g.value(policy_ref, TREE.value))
+            elif policy_type == LDES.LatestVersionSubset and g.value(policy_ref, LDES.amount):
+                retention_versions = int(g.value(policy_ref, LDES.amount))
+        return retention_period, retention_versions
+
+    def rdf_to_node(self, location:str, g: Graph, payload: str = None) -> LdesNode:
+        if payload is None:
+            payload = g.serialize(format='turtle')
         node_ref = g.value(None, RDF.type, TREE.Node)
         view_uri = g.value(node_ref, TREE.viewDescription)
         return LdesNode(node_ref, location, view_uri, payload, None)
@@ -74,12 +303,39 @@ class LdesClient():
         for _, __, relation_ref in g.triples((URIRef(node_uri), TREE.relation, None)):
             relation_type = g.value(relation_ref, RDF.type)
             target_node = g.value(relation_ref, TREE.node)
-            the_relation = LdesRelation(node_uri, str(relation_type), str(target_node), None, False)
+            # only a single predicate path can be compared, sequences and other property paths are left out
+            path = g.value(relation_ref, TREE.path)
+            value = g.value(relation_ref, TREE.value)
+            datatype = value.datatype if isinstance(value, Literal) else None
+            the_relation = LdesRelation(node_uri, str(relation_type), str(target_node), None, False,
+                str(path) if isinstance(path, URIRef) else None, str(value) if value is not None else None, str(datatype) if datatype else None)
             result.append(the_relation)
         return result
     
-    def headers_to_dict(self, headers):
-        result = {}
-        for key, value in headers:
-            result[key] = value
-        return result
\ No newline at end of file
+    def rdf_get_node_members(self, node_uri: str, g: Graph, view: LdesView = None, member_payload: Callable[[str], str] = None) -> List[LdesMember]:
+        stream_ref = g.value(predicate=RDF.type, object=LDES.EventStream)
+        version_of_path = g.value(stream_ref, LDES.versionOfPath) if stream_ref else None
+        timestamp_path = g.value(stream_ref, LDES.timestampPath) if stream_ref else None
+        if not version_of_path and view and view.version_of_path:
+            version_of_path = URIRef(view.version_of_path)
+        if not timestamp_path and view and view.timestamp_path:
+            timestamp_path = URIRef(view.timestamp_path)
+        result = []
+        for member_ref in set(g.objects(None, TREE.member)):
+            version_of = g.value(member_ref, version_of_path) if version_of_path else None
+            timestamp = g.value(member_ref, timestamp_path) if timestamp_path else None
+            if isinstance(timestamp, Literal):
+                # date time literals are stored as such, any other kind of timestamp as its lexical form
+                timestamp = timestamp.toPython() if isinstance(timestamp.toPython(), datetime.datetime) else str(timestamp)
+            payload = member_payload(str(member_ref)) if member_payload else g.cbd(member_ref).serialize(format='nt')
+            the_member = LdesMember(str(member_ref), node_uri, str(version_of) if version_of else None, timestamp, payload)
+            result.append(the_member)
+        return result
+    
+    def iter_spooled_members(self, node_uri: str, spool: NTriplesSpool, view: LdesView = None) -> Iterator[LdesMember]:
+        """Yields the members of a spooled fragment a batch at a time, the spool is closed once they were all read."""
+        try:
+            for g in spool.iter_member_graphs(version_of_path=view.version_of_path if view else None, timestamp_path=view.timestamp_path if view else None):
+                yield from self.rdf_get_node_members(node_uri, g, view, spool.cbd)
+        finally:
+            spool.close()
@@ -0,0 +1,88 @@
+'''
+LDES CODEC
+Concerns of the payload codecs:
+ - Compressing the fragment and member payloads kept in the alias database
+ - Training a shared zstd dictionary on a collection's payloads, as LDES fragments are highly repetitive
+'''
+import zlib
+from typing import List
+from ldes_client_error import LdesClientError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class PayloadCodec():
+    """Base class of the payload codecs, the name of a codec is stored with every payload it encoded."""
+
+    name = None
+
+    def encode(self, payload: str) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: bytes) -> str:
+        raise NotImplementedError()
+
+
+class ZlibCodec(PayloadCodec):
+
+    name = 'zlib'
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def encode(self, payload: str) -> bytes:
+        return zlib.compress(payload.encode(), self.level)
+
+    def decode(self, data: bytes) -> str:
+        return zlib.decompress(data).decode()
+
+
+class ZstdCodec(PayloadCodec):
+
+    name = 'zstd'
+
+    def __init__(self, level: int = 3, dictionary: bytes = None):
+        if not zstandard:
+            raise LdesClientError('The zstd payload codec requires the zstandard package.')
+        self.level = level
+        self.dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        if self.dictionary:
+            # payloads name the dictionary they were compressed with, so a collection's dictionary can be retrained
+            self.name = f'zstd-dict:{self.dictionary.dict_id()}'
+        # (de)compressors are not thread safe, so they are created per call
+        self.compressor_args = {'level': level, 'dict_data': self.dictionary} if self.dictionary else {'level': level}
+
+    def encode(self, payload: str) -> bytes:
+        return zstandard.ZstdCompressor(**self.compressor_args).compress(payload.encode())
+
+    def decode(self, data: bytes) -> str:
+        decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary) if self.dictionary else zstandard.ZstdDecompressor()
+        return decompressor.decompress(data).decode()
+
+
+CODECS = ['zlib', 'zstd', 'zstd-dict']
+
+def create_codec(name: str, dictionary: bytes = None) -> PayloadCodec:
+    if not name or name == 'none':
+        return None
+    elif name == 'zlib':
+        return ZlibCodec()
+    elif name == 'zstd':
+        return ZstdCodec()
+    elif name == 'zstd-dict' or name.startswith('zstd-dict:'):
+        if not dictionary:
+            raise LdesClientError('The zstd-dict payload codec requires a trained dictionary, run ldes compact with --dictionary first.')
+        return ZstdCodec(dictionary=dictionary)
+    raise LdesClientError(f'Unknown payload codec {name}, expected one of none, {", ".join(CODECS)}.')
+
+def train_dictionary(samples: List[str], size: int = 112640) -> bytes:
+    """Trains a zstd dictionary on sample payloads of a collection."""
+    if not zstandard:
+        raise LdesClientError('Training a payload dictionary requires the zstandard package.')
+    try:
+        return zstandard.train_dictionary(size, [sample.encode() for sample in samples]).as_bytes()
+    except zstandard.ZstdError as error:
+        raise LdesClientError(f'Could not train a payload dictionary on {len(samples)} samples, the collection may be too small. {error}', error)
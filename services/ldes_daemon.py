@@ -0,0 +1,227 @@
+'''
+LDES DAEMON
+Concerns of the LDES daemon:
+ - Synchronizing all onboarded LDES streams from a single process, with a shared scheduler and HTTP pool
+ - Bounding the number of streams that are synced concurrently, next to the per-stream fetch budgets of the syncers
+ - Pausing, resuming and stopping streams on request of the CLI through a control socket, and stopping on SIGTERM/SIGINT
+'''
+import heapq
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from ldes_client_error import LdesClientError
+from services.ldes_syncer import LdesSyncer
+
+CONTROL_SOCKET = 'ldes.sock'
+
+
+def get_control_socket(location: str) -> str:
+    return os.path.join(location, CONTROL_SOCKET)
+
+def discover_aliases(location: str) -> List[str]:
+    """Lists the aliases of the collections onboarded in the storage location."""
+    if not os.path.exists(location):
+        return []
+    return sorted(name[:-len('.db')] for name in os.listdir(location) if name.endswith('.db'))
+
+def send_daemon_command(location: str, command: str, timeout: float = 5.0) -> str:
+    """Sends a command to the daemon serving the storage location, returns its reply or None when no daemon is running."""
+    path = get_control_socket(location)
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall(f'{command}\n'.encode())
+            return client.makefile().readline().strip()
+    except (ConnectionRefusedError, FileNotFoundError):
+        # a stale socket left behind by a daemon that was killed
+        return None
+
+
+class LdesDaemon():
+
+    def __init__(self, location: str, syncer_factory: Callable[[str], LdesSyncer], max_concurrent_syncs: int = 4):
+        self.location = location
+        self.syncer_factory = syncer_factory
+        self.max_concurrent_syncs = max(1, max_concurrent_syncs)
+        self.syncers: Dict[str, LdesSyncer] = {}
+        self.paused = set()
+        self.running = set()
+        # aliases stopped on request, their views are flagged as stopped once their syncer finished (see LdesSyncer.stop_sync)
+        self.stopped = set()
+        # (due time, alias) entries of the shared scheduler and the current due time per alias, guarded by the condition
+        self.queue = []
+        self.due: Dict[str, float] = {}
+        self.condition = threading.Condition()
+        self.stopping = threading.Event()
+        self.control_server = None
+
+    def discover_aliases(self) -> List[str]:
+        return discover_aliases(self.location)
+
+    def reload(self):
+        """Starts syncing newly onboarded aliases and drops the ones that were deleted, stopped aliases are left alone."""
+        aliases = self.discover_aliases()
+        with self.condition:
+            for alias in list(self.syncers):
+                if alias not in aliases:
+                    self.__remove(alias)
+            for alias in aliases:
+                if alias not in self.syncers and alias not in self.stopped:
+                    self.__start(alias)
+            self.condition.notify_all()
+
+    def serve(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+            signal.signal(signal.SIGINT, lambda *_: self.stop())
+            if hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=self.reload).start())
+        self.__start_control_server()
+        try:
+            self.reload()
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_syncs, thread_name_prefix='ldes-sync') as executor:
+                while not self.stopping.is_set():
+                    with self.condition:
+                        now = time.monotonic()
+                        while self.queue and self.queue[0][0] <= now and len(self.running) < self.max_concurrent_syncs:
+                            due, alias = heapq.heappop(self.queue)
+                            # paused, stopped or rescheduled aliases are skipped, they are scheduled again when they resume
+                            if self.due.get(alias) == due and alias not in self.paused:
+                                del self.due[alias]
+                                self.running.add(alias)
+                                executor.submit(self.__run_cycle, alias)
+                        timeout = max(0, self.queue[0][0] - now) if self.queue and len(self.running) < self.max_concurrent_syncs else None
+                        self.condition.wait(timeout)
+        finally:
+            self.__stop_control_server()
+            with self.condition:
+                for alias in list(self.syncers):
+                    self.__remove(alias)
+
+    def stop(self):
+        self.stopping.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def handle_command(self, command: str) -> str:
+        action, _, alias = command.strip().partition(' ')
+        with self.condition:
+            if action == 'stop' and not alias:
+                self.stop()
+            elif action == 'reload':
+                threading.Thread(target=self.reload).start()
+            elif action == 'status':
+                return ' '.join(f'{name}:{self.__get_state(name)}' for name in sorted(self.syncers)) or 'idle'
+            elif action not in ('pause', 'resume', 'stop'):
+                return f'error: unknown command {action}'
+            elif action == 'resume' and alias not in self.syncers and alias in self.discover_aliases():
+                # a stopped alias is synced again, once the cycle it was stopped in finished
+                if alias in self.running:
+                    return f'error: view alias {alias} is still stopping, resume it again shortly'
+                self.stopped.discard(alias)
+                if not self.__start(alias, resume=True):
+                    return f'error: could not start syncing view alias {alias}'
+            elif alias not in self.syncers:
+                return f'error: view alias {alias} is not being synced'
+            elif action == 'pause':
+                self.paused.add(alias)
+            elif action == 'resume':
+                self.paused.discard(alias)
+                if alias not in self.running:
+                    self.__schedule(alias, time.monotonic())
+            else:
+                self.stopped.add(alias)
+                self.__remove(alias)
+            self.condition.notify_all()
+        return 'ok'
+
+    def __get_state(self, alias: str) -> str:
+        if alias in self.running:
+            return 'running'
+        return 'paused' if alias in self.paused else 'waiting'
+
+    def __run_cycle(self, alias: str):
+        syncer = self.syncers.get(alias)
+        try:
+            syncer.run_cycle()
+        except Exception as error:
+            print(f"WARNING: Sync cycle of {alias} failed. {error}", file=sys.stderr)
+        finally:
+            with self.condition:
+                self.running.discard(alias)
+                if alias in self.syncers:
+                    # the cycle is scheduled when the first node is due, the view's polling interval apart at most
+                    self.__schedule(alias, time.monotonic() + syncer.get_next_cycle_delay())
+                else:
+                    # stopped while it was running
+                    self.__finish(syncer)
+                self.condition.notify_all()
+
+    def __start(self, alias: str, resume: bool = False) -> bool:
+        try:
+            syncer = self.syncer_factory(alias)
+            if syncer.is_stopped() and not resume:
+                syncer.ldes_store.close()
+                return False
+            syncer.start_sync()
+        except Exception as error:
+            print(f"WARNING: Could not start syncing {alias}. {error}", file=sys.stderr)
+            return False
+        print(f"Syncing LDES view {alias} at most every {syncer.view.polling}s", file=sys.stderr)
+        self.syncers[alias] = syncer
+        self.__schedule(alias, time.monotonic())
+        return True
+
+    def __schedule(self, alias: str, due: float):
+        self.due[alias] = due
+        heapq.heappush(self.queue, (due, alias))
+
+    def __remove(self, alias: str):
+        syncer = self.syncers.pop(alias)
+        self.paused.discard(alias)
+        self.due.pop(alias, None)
+        if alias not in self.running:
+            self.__finish(syncer)
+
+    def __finish(self, syncer: LdesSyncer):
+        try:
+            syncer.finish_sync()
+            # shutting the daemon down does not stop its views, they are synced again when it is started
+            syncer.stop_sync(syncer.alias in self.stopped)
+        except LdesClientError as error:
+            print(f"WARNING: Could not stop syncing {syncer.alias}. {error}", file=sys.stderr)
+
+    def __start_control_server(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+        path = get_control_socket(self.location)
+        if send_daemon_command(self.location, 'status') is not None:
+            raise LdesClientError(f'Another LDES daemon is already serving {self.location}.')
+        if os.path.exists(path):
+            os.remove(path)
+        daemon = self
+        class ControlHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                reply = daemon.handle_command(self.rfile.readline().decode())
+                self.wfile.write(f'{reply}\n'.encode())
+        self.control_server = socketserver.ThreadingUnixStreamServer(path, ControlHandler)
+        self.control_server.daemon_threads = True
+        threading.Thread(target=self.control_server.serve_forever, name='ldes-control', daemon=True).start()
+
+    def __stop_control_server(self):
+        if self.control_server:
+            self.control_server.shutdown()
+            self.control_server.server_close()
+            self.control_server = None
+            path = get_control_socket(self.location)
+            if os.path.exists(path):
+                os.remove(path)
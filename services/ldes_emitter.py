@@ -0,0 +1,211 @@
+'''
+LDES EMITTER
+Concerns of the LDES emitters:
+ - Pushing newly stored members to downstream systems (NDJSON file/stdout, Redis streams, Kafka topics, ...)
+ - Delivering members at least once, by only advancing an emitter's consumer cursor after a batch was emitted
+ - Letting an emitter that falls behind or is down catch up from the store, without holding up the syncer
+'''
+import json
+import queue
+import sys
+import threading
+from typing import Callable, Dict, List
+from models import LdesMember
+from ldes_client_error import LdesClientError
+from services.ldes_store import LdesStore
+
+
+def member_to_dict(member: LdesMember, alias: str = None) -> Dict:
+    """Returns the fields of a member, with the alias of its collection when given (emitters of several collections share their targets)."""
+    result = {'alias': alias} if alias else {}
+    result.update({
+        'uri': member.uri,
+        'seq': member.seq,
+        'node_uri': member.node_uri,
+        'version_of': member.version_of,
+        'timestamp': member.timestamp.isoformat() if hasattr(member.timestamp, 'isoformat') else member.timestamp,
+        'payload': member.payload,
+    })
+    return result
+
+
+class LdesEmitter():
+    """Base class of the emitter plugins, emit() either delivers the entire batch or raises."""
+
+    def __init__(self, name: str):
+        self.name = name
+        # the alias of the collection the members are emitted from, set by the LdesEmitterDispatcher
+        self.alias = None
+
+    def emit(self, members: List[LdesMember]):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class NdjsonEmitter(LdesEmitter):
+
+    def __init__(self, name: str = 'ndjson', path: str = None):
+        super().__init__(name)
+        self.path = path
+        # without a path the members go to stdout, the syncer and the daemon report their progress on stderr
+        self.output = open(path, 'a', encoding='utf-8') if path else sys.stdout
+
+    def emit(self, members: List[LdesMember]):
+        self.output.write(''.join(json.dumps(member_to_dict(member, self.alias)) + '\n' for member in members))
+        self.output.flush()
+
+    def close(self):
+        if self.path:
+            self.output.close()
+
+
+class RedisStreamEmitter(LdesEmitter):
+
+    def __init__(self, name: str = 'redis', stream: str = 'ldes', url: str = 'redis://localhost:6379/0', maxlen: int = None, client=None):
+        super().__init__(name)
+        self.stream = stream
+        self.maxlen = maxlen
+        if client is None:
+            try:
+                import redis
+            except ImportError as error:
+                raise LdesClientError('The redis emitter requires the redis package.', error)
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def emit(self, members: List[LdesMember]):
+        pipeline = self.client.pipeline()
+        for member in members:
+            fields = {key: '' if value is None else str(value) for key, value in member_to_dict(member, self.alias).items()}
+            pipeline.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+        pipeline.execute()
+
+    def close(self):
+        self.client.close()
+
+
+class KafkaEmitter(LdesEmitter):
+
+    def __init__(self, name: str = 'kafka', topic: str = 'ldes', bootstrap_servers: str = 'localhost:9092', producer=None):
+        super().__init__(name)
+        self.topic = topic
+        if producer is None:
+            try:
+                from kafka import KafkaProducer
+            except ImportError as error:
+                raise LdesClientError('The kafka emitter requires the kafka-python package.', error)
+            producer = KafkaProducer(bootstrap_servers=bootstrap_servers, acks='all')
+        self.producer = producer
+
+    def emit(self, members: List[LdesMember]):
+        futures = [self.producer.send(self.topic, key=member.uri.encode(), value=json.dumps(member_to_dict(member, self.alias)).encode()) for member in members]
+        self.producer.flush()
+        # surface delivery failures, so that the batch is retried
+        for future in futures:
+            future.get()
+
+    def close(self):
+        self.producer.close()
+
+
+EMITTER_TYPES = {
+    'ndjson': NdjsonEmitter,
+    'redis': RedisStreamEmitter,
+    'kafka': KafkaEmitter,
+}
+
+def create_emitters(configs: List[Dict]) -> List[LdesEmitter]:
+    """Creates the emitters listed in the configuration, each entry names its type and the emitter's arguments."""
+    result = []
+    for config in configs or []:
+        config = dict(config)
+        emitter_type = config.pop('type', None)
+        if emitter_type not in EMITTER_TYPES:
+            raise LdesClientError(f'Unknown emitter type {emitter_type}, expected one of {", ".join(EMITTER_TYPES)}.')
+        result.append(EMITTER_TYPES[emitter_type](**config))
+    return result
+
+
+class LdesEmitterDispatcher():
+    """Runs every emitter on its own thread, feeding it the store's members from the emitter's consumer cursor.
+
+    The syncer notifies the dispatcher of newly stored members, notify() never blocks: a notification only wakes an emitter
+    up, which then reads everything after its cursor, so the notifications that pile up are coalesced into one. The
+    members an emitter falls behind on (e.g. while its target is down) wait in the store, the syncer is not held up.
+    """
+
+    def __init__(self, store_factory: Callable[[], LdesStore], emitters: List[LdesEmitter], batch_size: int = 500,
+            retry_delay: float = 1.0, max_retry_delay: float = 60.0, alias: str = None):
+        self.store_factory = store_factory
+        self.emitters = emitters
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        for emitter in emitters:
+            emitter.alias = alias
+        self.queues = {emitter.name: queue.Queue(maxsize=1) for emitter in emitters}
+        self.stopping = threading.Event()
+        self.threads = {}
+
+    def start(self):
+        self.stopping.clear()
+        for emitter in self.emitters:
+            thread = threading.Thread(target=self.__run, args=(emitter,), name=f'emitter-{emitter.name}', daemon=True)
+            thread.start()
+            self.threads[emitter.name] = thread
+
+    def notify(self):
+        for notifications in self.queues.values():
+            self.__wake_up(notifications)
+
+    def stop(self):
+        self.stopping.set()
+        for notifications in self.queues.values():
+            self.__wake_up(notifications)
+        for thread in self.threads.values():
+            thread.join()
+        self.threads = {}
+        for emitter in self.emitters:
+            emitter.close()
+
+    def __run(self, emitter: LdesEmitter):
+        # sqlite connections are bound to their thread, so every emitter reads through a store of its own
+        store = self.store_factory()
+        consumer = f'emitter:{emitter.name}'
+        notifications = self.queues[emitter.name]
+        try:
+            while True:
+                ## (1) emit everything stored after the cursor, including members stored before a restart
+                cursor = store.get_consumer_cursor(consumer)
+                members = store.get_changes(cursor, self.batch_size)
+                while members and self.__emit(emitter, members):
+                    cursor = members[-1].seq
+                    store.set_consumer_cursor(consumer, cursor)
+                    members = store.get_changes(cursor, self.batch_size)
+                if self.stopping.is_set():
+                    return
+                ## (2) wait for the syncer to store new members, the notifications that came in meanwhile are coalesced into one
+                notifications.get()
+        finally:
+            store.close()
+
+    def __wake_up(self, notifications: queue.Queue):
+        try:
+            notifications.put_nowait(True)
+        except queue.Full:
+            # a wake-up is pending already
+            pass
+
+    def __emit(self, emitter: LdesEmitter, members: List[LdesMember]) -> bool:
+        delay = self.retry_delay
+        while True:
+            try:
+                emitter.emit(members)
+                return True
+            except Exception as error:
+                print(f"WARNING: Emitter {emitter.name} failed to emit {len(members)} members, retrying in {delay}s. {error}", file=sys.stderr)
+            if self.stopping.wait(delay):
+                return False
+            delay = min(delay * 2, self.max_retry_delay)
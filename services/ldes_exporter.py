@@ -0,0 +1,146 @@
+'''
+LDES EXPORTER
+Concerns of the LDES exporter:
+ - Streaming the stored members of a collection out as N-Quads, NDJSON, JSON-LD or Parquet, in constant memory
+ - Streaming a snapshot holding only the latest version of every entity out in the same formats
+ - Framing the JSON-LD members with the pyldes:memberFrameSpec of the view, when it has one
+ - Optionally encoding the members on several processes, as parsing and serializing RDF is CPU bound
+'''
+import json
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List
+from rdflib import Graph
+from models import LdesMember
+from ldes_client_error import LdesClientError
+from services.ldes_store import LdesStore
+from services.ldes_emitter import member_to_dict
+from services.ldes_ntriples import parse_statement
+
+try:
+    from pyld import jsonld
+except ImportError:
+    jsonld = None
+
+EXPORT_FORMATS = ['nquads', 'ndjson', 'jsonld', 'parquet']
+
+
+def member_to_nquads(member: LdesMember) -> str:
+    """Puts the triples of a member in a named graph of its own, its blank nodes are relabeled to keep them apart from other members'."""
+    lines = []
+    graph = f'<{member.uri}>'
+    for line in member.payload.splitlines():
+        statement = parse_statement(line)
+        if statement:
+            terms = [f'_:m{member.seq}_{term[2:]}' if term.startswith('_:') else term for term in statement]
+            lines.append(f'{terms[0]} {terms[1]} {terms[2]} {graph} .\n')
+    return ''.join(lines)
+
+def member_to_jsonld(member: LdesMember, frame: Dict = None) -> str:
+    g = Graph()
+    g.parse(data=member.payload, format='nt')
+    document = json.loads(g.serialize(format='json-ld'))
+    if frame:
+        document = jsonld.frame(document, frame)
+    return json.dumps(document)
+
+def encode_members(export_format: str, members: List[LdesMember], frame: Dict = None) -> str:
+    """Encodes a batch of members in one of the text formats, this runs on the worker processes of a parallel export."""
+    if export_format == 'nquads':
+        return ''.join(member_to_nquads(member) for member in members)
+    elif export_format == 'ndjson':
+        return ''.join(json.dumps(member_to_dict(member)) + '\n' for member in members)
+    elif export_format == 'jsonld':
+        return ''.join(member_to_jsonld(member, frame) + '\n' for member in members)
+    raise LdesClientError(f'Unknown export format {export_format}, expected one of {", ".join(EXPORT_FORMATS)}.')
+
+
+class LdesExporter():
+
+    def __init__(self, ldes_store: LdesStore, batch_size: int = 1000, workers: int = 1, snapshot: bool = False):
+        self.ldes_store = ldes_store
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        # a snapshot exports the latest version of every entity, ordered by entity IRI instead of in store order
+        self.snapshot = snapshot
+
+    def export(self, export_format: str, output: str = None, since: int = 0) -> int:
+        """Writes the members stored after sequence number since to the output file (stdout by default), returns how many were written."""
+        if export_format not in EXPORT_FORMATS:
+            raise LdesClientError(f'Unknown export format {export_format}, expected one of {", ".join(EXPORT_FORMATS)}.')
+        if export_format == 'parquet':
+            return self.export_parquet(output, since)
+        frame = self.get_member_frame() if export_format == 'jsonld' else None
+        count = 0
+        stream = open(output, 'w', encoding='utf-8') if output else sys.stdout
+        try:
+            for members, data in self.iter_encoded(export_format, since, frame):
+                stream.write(data)
+                count += members
+        finally:
+            if output:
+                stream.close()
+            else:
+                stream.flush()
+        return count
+
+    def export_parquet(self, output: str, since: int = 0) -> int:
+        if not output:
+            raise LdesClientError('A Parquet export needs an output file.')
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise LdesClientError('The Parquet export requires the pyarrow package.', error)
+        schema = pyarrow.schema([(name, pyarrow.int64() if name == 'seq' else pyarrow.string())
+            for name in ('seq', 'uri', 'node_uri', 'version_of', 'timestamp', 'payload')])
+        count = 0
+        # every batch of members becomes a row group, so only a single batch is held in memory
+        with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+            for members in self.iter_batches(since):
+                rows = [member_to_dict(member) for member in members]
+                writer.write_batch(pyarrow.RecordBatch.from_pylist(rows, schema=schema))
+                count += len(members)
+        return count
+
+    def iter_batches(self, since: int = 0) -> Iterator[List[LdesMember]]:
+        after = ''
+        while True:
+            if self.snapshot:
+                members = self.ldes_store.get_latest_versions(self.batch_size, after)
+            else:
+                members = self.ldes_store.get_changes(since, self.batch_size)
+            if not members:
+                return
+            yield members
+            since, after = members[-1].seq, members[-1].version_of
+
+    def iter_encoded(self, export_format: str, since: int = 0, frame: Dict = None) -> Iterator[tuple]:
+        """Yields (number of members, encoded text) per batch in store order, encoded on worker processes when there are several."""
+        if self.workers == 1:
+            for members in self.iter_batches(since):
+                yield len(members), encode_members(export_format, members, frame)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # a bounded window of batches is in flight, so the export does not read ahead of the writer
+            pending = deque()
+            for members in self.iter_batches(since):
+                if len(pending) >= 2 * self.workers:
+                    size, future = pending.popleft()
+                    yield size, future.result()
+                pending.append((len(members), executor.submit(encode_members, export_format, members, frame)))
+            while pending:
+                size, future = pending.popleft()
+                yield size, future.result()
+
+    def get_member_frame(self) -> Dict:
+        view = self.ldes_store.get_view()
+        if not view or not view.member_frame:
+            return None
+        if not jsonld:
+            raise LdesClientError('Framing the members with the pyldes:memberFrameSpec of the view requires the PyLD package.')
+        try:
+            return json.loads(view.member_frame)
+        except ValueError as error:
+            raise LdesClientError(f'The pyldes:memberFrameSpec of the view is not a valid JSON-LD frame. {error}', error)
@@ -0,0 +1,182 @@
+'''
+LDES HTTP POOL
+Concerns of the LDES HTTP pool:
+ - Keeping HTTP and HTTPS connections alive per host so that consecutive fragment requests reuse them
+ - Negotiating and transparently decoding compressed (gzip, deflate, br) response bodies
+ - Bounding the time spent connecting to a host and waiting for its data
+'''
+import http.client
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import urlparse
+from ldes_client_error import LdesClientError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# errors raised when a pooled keep-alive connection turned out to be closed by the server
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LdesHttpResponse():
+
+    def __init__(self, response: http.client.HTTPResponse):
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.consumed = False
+        # number of (possibly compressed) body bytes received
+        self.bytes_read = 0
+        self.decoder = self.__get_decoder(response.getheader('Content-Encoding'))
+
+    def getheader(self, name: str, default: str = None) -> str:
+        return self.response.getheader(name, default)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yields the decoded response body in chunks, decompressing while reading."""
+        while True:
+            chunk = self.response.read(chunk_size)
+            if not chunk:
+                break
+            self.bytes_read += len(chunk)
+            data = self.decoder(chunk) if self.decoder else chunk
+            if data:
+                yield data
+        if self.decoder:
+            tail = self.decoder(None)
+            if tail:
+                yield tail
+        self.consumed = True
+
+    def read(self) -> bytes:
+        return b''.join(self.iter_chunks())
+
+    def __get_decoder(self, content_encoding: str):
+        encoding = (content_encoding or 'identity').strip().lower()
+        if encoding == 'identity':
+            return None
+        elif encoding in ('gzip', 'x-gzip', 'deflate'):
+            # wbits 47 auto-detects gzip and zlib headers, raw deflate streams are handled as a fallback
+            decompressor = [zlib.decompressobj(47)]
+            def decode(chunk):
+                if chunk is None:
+                    return decompressor[0].flush()
+                try:
+                    return decompressor[0].decompress(chunk)
+                except zlib.error:
+                    if encoding != 'deflate':
+                        raise
+                    decompressor[0] = zlib.decompressobj(-zlib.MAX_WBITS)
+                    return decompressor[0].decompress(chunk)
+            return decode
+        elif encoding == 'br' and brotli:
+            decompressor = brotli.Decompressor()
+            return lambda chunk: decompressor.process(chunk) if chunk is not None else b''
+        else:
+            raise LdesClientError(f"Unsupported content encoding {content_encoding}.")
+
+
+class LdesHttpPool():
+
+    def __init__(self, max_idle_per_host: int = 8, compression: bool = True, timeout: float = None):
+        self.max_idle_per_host = max_idle_per_host
+        self.compression = compression
+        # seconds to connect, and to wait for every read of a response, before a socket.timeout (None waits forever)
+        self.timeout = timeout or None
+        self.idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self.lock = threading.Lock()
+
+    def accept_encoding(self) -> str:
+        if not self.compression:
+            return 'identity'
+        return 'gzip, deflate, br' if brotli else 'gzip, deflate'
+
+    @contextmanager
+    def request(self, method: str, location: str, headers: Dict[str, str] = None) -> Iterator[LdesHttpResponse]:
+        """Sends a request over a pooled connection and yields the response.
+
+        The connection is handed back to the pool when the body was fully read, and closed otherwise.
+        """
+        url = urlparse(location)
+        key = self.__host_key(url)
+        target = (url.path or '/') + (f'?{url.query}' if url.query else '')
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', self.accept_encoding())
+        conn, response = self.__send(key, method, target, headers)
+        the_response = LdesHttpResponse(response)
+        try:
+            yield the_response
+        except BaseException:
+            conn.close()
+            raise
+        if method == 'HEAD' or response.status in (204, 304):
+            # bodiless responses still have to be read to close them, a connection refuses to send while a response is open
+            response.read()
+            the_response.consumed = True
+        if the_response.consumed and not response.will_close:
+            self.__release(key, conn)
+        else:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def __send(self, key: Tuple[str, str, int], method: str, target: str, headers: Dict[str, str]):
+        conn, reused = self.__acquire(key)
+        try:
+            conn.request(method, target, headers=headers)
+            return conn, conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+        except BaseException:
+            # timeouts, refused connections, ... leave the connection in an unknown state
+            conn.close()
+            raise
+        # the server dropped an idle keep-alive connection, retry once on a fresh one
+        conn = self.__new_connection(key)
+        try:
+            conn.request(method, target, headers=headers)
+            return conn, conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def __acquire(self, key: Tuple[str, str, int]) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop(), True
+        return self.__new_connection(key), False
+
+    def __release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def __new_connection(self, key: Tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def __host_key(self, url) -> Tuple[str, str, int]:
+        scheme = (url.scheme or 'http').lower()
+        if scheme not in ('http', 'https'):
+            raise LdesClientError(f"Unsupported URL scheme {url.scheme}.")
+        return scheme, url.hostname, url.port
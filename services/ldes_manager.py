@@ -5,10 +5,19 @@ Concerns of the LDES manager:
  - Updating existing LDES streams
  - Deleting LDES streams
  - Reporting LDES stream status
+ - Feeding the members received since a given cursor to consumers
+ - Compacting the storage of LDES streams
+ - Deleting the members of LDES streams that fell out of their retention window
+ - Exporting the stored members of LDES streams
+ - Looking up the current state (latest version) of the entities of LDES streams
 '''
 from sqlite3 import Error
-from services.ldes_store import LdesStore
+from typing import Dict, Iterator
+from models import LdesMember
+from ldes_client_error import LdesClientError
+from services.ldes_store import LdesStore, parse_retention_period
 from services.ldes_client import LdesClient
+from services.ldes_exporter import LdesExporter
 
 
 class LdesManager():
@@ -18,10 +27,31 @@ class LdesManager():
         self.ldes_store = ldes_store
         self.ldes_client = ldes_client
 
-    def onboard_ldes_view(self, alias: str, location: str, polling: int = 60):
-        self.ldes_store.create_view_db()
-        the_view  = self.ldes_client.get_ldes_view(location)
+    def onboard_ldes_view(self, alias: str, location: str, polling: int = 60, filter_path: str = None, 
+            filter_min: str = None, filter_max: str = None, filter_prefix: str = None, 
+            retention_period: str = None, retention_versions: int = None, no_retention: bool = False, accept: str = None):
+        """Onboards the view at location, the optional filter restricts the crawl to the subtrees holding members
+        with a value of filter_path (by default the timestamp path) between filter_min and filter_max or starting with filter_prefix.
+        The retention policies of the view are overridden by retention_period and retention_versions, or ignored with no_retention.
+        The fragments are requested with the accept header, the client's default preferences when None.
+        The view is fetched and the arguments are checked before the collection database is created."""
+        the_view  = self.ldes_client.get_ldes_view(location, accept)
+        if (filter_min is not None or filter_max is not None or filter_prefix is not None) and not (filter_path or the_view.timestamp_path):
+            # without a path the filter would be checked against the relations on any path, and prune subtrees it does not apply to
+            raise LdesClientError(f'The view at {location} has no timestamp path, a filter path is required to filter it.')
+        if retention_period:
+            # an invalid period would only surface in the garbage collection of the first sync cycle
+            parse_retention_period(retention_period)
         the_view.polling = polling
+        the_view.filter_path = filter_path
+        the_view.filter_min = filter_min
+        the_view.filter_max = filter_max
+        the_view.filter_prefix = filter_prefix
+        if no_retention:
+            the_view.retention_period, the_view.retention_versions = None, None
+        if retention_period or retention_versions:
+            the_view.retention_period, the_view.retention_versions = retention_period, retention_versions
+        self.ldes_store.create_view_db()
         self.ldes_store.create_view(the_view)
 
     def update_ldes_view(self, alias: str, location: str, polling: int = 60):
@@ -30,6 +60,43 @@ class LdesManager():
     def delete_ldes_view(self):
         self.ldes_store.delete_view_db()
 
-    def report_ldes_view_status(self, alias: str):
-        pass
+    def collect_ldes_garbage(self):
+        return self.ldes_store.collect_garbage(self.ldes_store.get_view())
+
+    def compact_ldes_view(self, codec: str = None, dictionary: bool = False):
+        self.ldes_store.compact(codec, dictionary)
+
+    def export_ldes_view(self, export_format: str = 'nquads', output: str = None, since: int = 0, workers: int = 1) -> int:
+        return LdesExporter(self.ldes_store, workers=workers).export(export_format, output, since)
+
+    def snapshot_ldes_view(self, export_format: str = 'nquads', output: str = None, workers: int = 1) -> int:
+        return LdesExporter(self.ldes_store, workers=workers, snapshot=True).export(export_format, output)
+
+    def get_ldes_entity(self, version_of: str) -> LdesMember:
+        return self.ldes_store.get_latest_version(version_of)
+
+    def report_ldes_view_status(self) -> Dict[str, object]:
+        """Returns the view's sync settings next to the sizes of its work queues and collection, or None when no view was onboarded."""
+        view = self.ldes_store.get_view()
+        if not view:
+            return None
+        status = {'location': view.location, 'polling': view.polling, 'sync': bool(view.sync), 'accept': view.accept or 'default'}
+        status.update(self.ldes_store.get_stats())
+        return status
+
+    def iter_ldes_changes(self, since: int = None, consumer: str = None, batch_size: int = 1000) -> Iterator[LdesMember]:
+        """Yields the members stored after cursor since, or after the persisted cursor of the named consumer.
+
+        The consumer cursor only advances once a batch was entirely consumed, so delivery is at least once.
+        """
+        if since is None:
+            since = self.ldes_store.get_consumer_cursor(consumer) if consumer else 0
+        while True:
+            members = self.ldes_store.get_changes(since, batch_size)
+            if not members:
+                return
+            yield from members
+            since = members[-1].seq
+            if consumer:
+                self.ldes_store.set_consumer_cursor(consumer, since)
 
@@ -0,0 +1,143 @@
+'''
+LDES METRICS
+Concerns of the LDES metrics:
+ - Counting what the syncers and clients do (fragments fetched per status, bytes, members stored, ...) and timing it
+ - Exposing the metrics in the Prometheus text format, through a file (node exporter textfile collector) or an HTTP endpoint
+ - Tracing fetches, parses and store writes as spans, handed to OpenTelemetry when it is installed
+'''
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Tuple
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# upper bounds (in seconds) of the buckets of the duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def to_labels(labels: Dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def format_labels(labels: Labels) -> str:
+    items = [f'{name}="{value}"'.replace('\n', ' ') for name, value in labels]
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+class LdesMetrics():
+    """Registry of the counters, gauges and duration histograms of a process, shared by all of its syncers and clients."""
+
+    def __init__(self, prefix: str = 'ldes'):
+        self.prefix = prefix
+        self.families: Dict[str, Tuple[str, str]] = {}
+        self.values: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, List[float]]] = {}
+        self.lock = threading.Lock()
+        self.tracer = trace.get_tracer('pyldesclient') if trace else None
+        self.server = None
+
+    def inc(self, name: str, value: float = 1, description: str = None, **labels):
+        """Increments the counter name (without prefix and _total suffix) with the given labels."""
+        key = self.__register(f'{name}_total', 'counter', description)
+        with self.lock:
+            series = self.values.setdefault(key, {})
+            labels = to_labels(labels)
+            series[labels] = series.get(labels, 0) + value
+
+    def set(self, name: str, value: float, description: str = None, **labels):
+        key = self.__register(name, 'gauge', description)
+        with self.lock:
+            self.values.setdefault(key, {})[to_labels(labels)] = value
+
+    def observe(self, name: str, seconds: float, description: str = None, **labels):
+        """Adds a duration to the histogram name (without prefix and _seconds suffix)."""
+        key = self.__register(f'{name}_seconds', 'histogram', description)
+        with self.lock:
+            # the cumulative bucket counts, followed by the sum and the count of the observations
+            histogram = self.histograms.setdefault(key, {}).setdefault(to_labels(labels), [0] * (len(DURATION_BUCKETS) + 2))
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[None]:
+        """Times the enclosed block into the histogram name, and traces it as an OpenTelemetry span when available."""
+        start = time.perf_counter()
+        if self.tracer:
+            with self.tracer.start_as_current_span(f'ldes.{name}', attributes={key: str(value) for key, value in attributes.items()}):
+                try:
+                    yield
+                finally:
+                    self.observe(name, time.perf_counter() - start, **attributes)
+        else:
+            try:
+                yield
+            finally:
+                self.observe(name, time.perf_counter() - start, **attributes)
+
+    def get(self, name: str, **labels) -> float:
+        """Returns the value of a counter (including its _total suffix) or gauge, 0 when it was not recorded."""
+        with self.lock:
+            return self.values.get(f'{self.prefix}_{name}', {}).get(to_labels(labels), 0)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for key, (kind, description) in sorted(self.families.items()):
+                if description:
+                    lines.append(f'# HELP {key} {description}')
+                lines.append(f'# TYPE {key} {kind}')
+                for labels, value in sorted(self.values.get(key, {}).items()):
+                    lines.append(f'{key}{format_labels(labels)} {value}')
+                for labels, histogram in sorted(self.histograms.get(key, {}).items()):
+                    for bound, count in zip(DURATION_BUCKETS + ('+Inf',), histogram[:-2] + histogram[-1:]):
+                        lines.append(f'{key}_bucket{format_labels(labels + (("le", bound),))} {count}')
+                    lines.append(f'{key}_sum{format_labels(labels)} {histogram[-2]}')
+                    lines.append(f'{key}_count{format_labels(labels)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str):
+        """Writes the metrics to path, through a temporary file so that readers never see a partially written one."""
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as output:
+            output.write(self.to_prometheus())
+        os.replace(temporary, path)
+
+    def serve(self, port: int, host: str = ''):
+        """Serves the metrics on http://host:port/metrics from a background thread."""
+        metrics = self
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='ldes-metrics', daemon=True).start()
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __register(self, name: str, kind: str, description: str) -> str:
+        key = f'{self.prefix}_{name}'
+        if key not in self.families or (description and not self.families[key][1]):
+            with self.lock:
+                self.families[key] = (kind, description)
+        return key
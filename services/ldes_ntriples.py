@@ -0,0 +1,195 @@
+'''
+LDES N-TRIPLES
+Concerns of the line-based RDF reader:
+ - Reading N-Triples and N-Quads fragments line by line while they are being downloaded
+ - Handing rdflib only the structural triples (node, relations, stream description, member versions and timestamps)
+ - Cutting the member descriptions straight out of the received lines, without parsing or serializing them
+ - Spooling fragments too large to be held in memory to a scratch database on disk, and reading their members in batches
+'''
+import codecs
+import itertools
+import re
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+from rdflib import Graph, RDF
+from namespace import LDES, TREE, PYLDES
+
+IRI = r'<[^>]*>'
+BNODE = r'_:[^\s<>"]+?'
+LITERAL = r'"(?:[^"\\]|\\.)*"(?:@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*|\^\^<[^>]*>)?'
+STATEMENT = re.compile(rf'^\s*({IRI}|{BNODE})\s+({IRI})\s+({IRI}|{BNODE}|{LITERAL})\s*(?:({IRI}|{BNODE})\s*)?\.\s*(?:#.*)?$')
+
+# predicates of the triples needed to find the node, its relations, its members and the stream description
+STRUCTURAL_PREDICATES = {f'<{predicate}>' for predicate in (
+    RDF.type, TREE.relation, TREE.node, TREE.path, TREE.value, TREE.remainingItems, TREE.viewDescription, TREE.view, TREE.member,
+    LDES.versionOfPath, LDES.timestampPath, LDES.retentionPolicy, LDES.amount, PYLDES.alias, PYLDES.memberFrameSpec,
+)}
+
+def parse_statement(line: str) -> Tuple[str, str, str]:
+    """Splits an N-Triples or N-Quads line into its subject, predicate and object terms, the graph term is dropped."""
+    match = STATEMENT.match(line)
+    if not match:
+        if line.strip() and not line.lstrip().startswith('#'):
+            raise ValueError(f'Invalid N-Triples statement: {line.strip()}')
+        return None
+    return match.group(1), match.group(2), match.group(3)
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Decodes a stream of UTF-8 chunks into lines."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in chunks:
+        data = decoder.decode(chunk)
+        *lines, pending = (pending + data).split('\n')
+        yield from lines
+    data = decoder.decode(b'', final=True)
+    if pending + data:
+        yield pending + data
+
+
+class NTriplesIndex():
+
+    def __init__(self):
+        self.statements: Dict[str, List[Tuple[str, str, str]]] = {}
+        self.payload = None
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[bytes], max_size: int = None) -> Union['NTriplesIndex', 'NTriplesSpool']:
+        """Indexes the lines of the chunks in memory, or spools them to disk once they exceed max_size characters."""
+        index = cls()
+        text = []
+        size = 0
+        lines = iter_lines(chunks)
+        for line in lines:
+            size += len(line) + 1
+            if max_size and size > max_size:
+                # the statements indexed so far and the remaining lines go to the spool, the text is not kept at all
+                indexed = (f'{s} {p} {o} .' for statements in index.statements.values() for s, p, o in statements)
+                return NTriplesSpool.from_lines(itertools.chain(indexed, [line], lines))
+            text.append(line)
+            statement = parse_statement(line)
+            if statement:
+                index.statements.setdefault(statement[0], []).append(statement)
+        index.payload = ''.join(f'{line}\n' for line in text)
+        return index
+
+    def structural_graph(self, version_of_path: str = None, timestamp_path: str = None) -> Graph:
+        """Parses only the structural triples (and the member versions and timestamps) into an rdflib graph."""
+        predicates = set(STRUCTURAL_PREDICATES)
+        # the stream may describe its own paths, which take precedence over the given ones
+        for statements in self.statements.values():
+            for _, predicate, value in statements:
+                if predicate == f'<{LDES.versionOfPath}>':
+                    version_of_path = value[1:-1]
+                elif predicate == f'<{LDES.timestampPath}>':
+                    timestamp_path = value[1:-1]
+        predicates.update(f'<{path}>' for path in (version_of_path, timestamp_path) if path)
+        lines = [f'{s} {p} {o} .' for statements in self.statements.values() for s, p, o in statements if p in predicates]
+        g = Graph()
+        g.parse(data='\n'.join(lines), format='nt')
+        return g
+
+    def cbd(self, subject: str) -> str:
+        """Returns the concise bounded description of subject (an IRI or blank node) as N-Triples."""
+        term = subject if subject.startswith('_:') else f'<{subject}>'
+        lines = []
+        seen: Set[str] = set()
+        todo = [term]
+        while todo:
+            term = todo.pop()
+            if term in seen:
+                continue
+            seen.add(term)
+            for s, p, o in self.statements.get(term, []):
+                lines.append(f'{s} {p} {o} .\n')
+                if o.startswith('_:'):
+                    todo.append(o)
+        return ''.join(lines)
+
+
+class NTriplesSpool():
+    """The statements of a fragment too large to be held in memory, in a private scratch database on disk.
+
+    Only the structural triples, without the tree:member ones, are kept as the payload of the fragment. The members are
+    read in batches (see iter_member_graphs) while they are stored, so memory use does not depend on the fragment size.
+    The scratch database is deleted when the spool is closed.
+    """
+
+    def __init__(self):
+        # an empty file name opens a temporary database on disk, it is written by a fetching thread and read by the syncing one
+        self.connection = sqlite3.connect('', check_same_thread=False)
+        self.connection.execute('CREATE TABLE statements (subject TEXT, predicate TEXT, object TEXT)')
+        self.payload = None
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str], batch_size: int = 10000) -> 'NTriplesSpool':
+        spool = cls()
+        statements = filter(None, map(parse_statement, lines))
+        with spool.connection:
+            while True:
+                batch = list(itertools.islice(statements, batch_size))
+                if not batch:
+                    break
+                spool.connection.executemany('INSERT INTO statements VALUES (?,?,?)', batch)
+            spool.connection.execute('CREATE INDEX statements_subject_idx ON statements(subject)')
+            spool.connection.execute('CREATE INDEX statements_predicate_idx ON statements(predicate)')
+        # the members and their types are left out, only the types of the TREE and LDES vocabularies are structural
+        predicates = tuple(STRUCTURAL_PREDICATES - {f'<{TREE.member}>'})
+        cursor = spool.connection.execute(f'''SELECT subject, predicate, object FROM statements WHERE predicate IN ({",".join("?" * len(predicates))}) 
+            AND (predicate<>? OR object LIKE ? OR object LIKE ?)''', (*predicates, f'<{RDF.type}>', f'<{TREE._NS}%', f'<{LDES._NS}%'))
+        spool.payload = ''.join(f'{s} {p} {o} .\n' for s, p, o in cursor)
+        return spool
+
+    def structural_graph(self, version_of_path: str = None, timestamp_path: str = None) -> Graph:
+        """Parses the structural triples into an rdflib graph, the members are left out (see iter_member_graphs)."""
+        g = Graph()
+        g.parse(data=self.payload, format='nt')
+        return g
+
+    def iter_member_graphs(self, batch_size: int = 500, version_of_path: str = None, timestamp_path: str = None) -> Iterator[Graph]:
+        """Yields graphs holding the stream description, and the tree:member triples with the version and timestamp of batch_size members each.
+
+        The paths the stream describes itself take precedence over the given ones (those of the view), like in NTriplesIndex.structural_graph.
+        """
+        description = self.connection.execute('SELECT subject, predicate, object FROM statements WHERE (predicate=? AND object=?) OR predicate IN (?,?)', 
+            (f'<{RDF.type}>', f'<{LDES.EventStream}>', f'<{LDES.versionOfPath}>', f'<{LDES.timestampPath}>')).fetchall()
+        for _, predicate, value in description:
+            if predicate == f'<{LDES.versionOfPath}>':
+                version_of_path = value[1:-1]
+            elif predicate == f'<{LDES.timestampPath}>':
+                timestamp_path = value[1:-1]
+        paths = [f'<{path}>' for path in (version_of_path, timestamp_path) if path]
+        members = self.connection.execute('SELECT subject, predicate, object FROM statements WHERE predicate=?', (f'<{TREE.member}>',))
+        while True:
+            batch = members.fetchmany(batch_size)
+            if not batch:
+                return
+            lines = [f'{s} {p} {o} .' for s, p, o in description + batch]
+            if paths:
+                terms = [o for _, _, o in batch]
+                cursor = self.connection.execute(f'SELECT subject, predicate, object FROM statements WHERE subject IN ({",".join("?" * len(terms))}) '
+                    f'AND predicate IN ({",".join("?" * len(paths))})', (*terms, *paths))
+                lines.extend(f'{s} {p} {o} .' for s, p, o in cursor)
+            g = Graph()
+            g.parse(data='\n'.join(lines), format='nt')
+            yield g
+
+    def cbd(self, subject: str) -> str:
+        """Returns the concise bounded description of subject (an IRI or blank node) as N-Triples."""
+        term = subject if subject.startswith('_:') else f'<{subject}>'
+        lines = []
+        seen: Set[str] = set()
+        todo = [term]
+        while todo:
+            term = todo.pop()
+            if term in seen:
+                continue
+            seen.add(term)
+            for s, p, o in self.connection.execute('SELECT subject, predicate, object FROM statements WHERE subject=?', (term,)):
+                lines.append(f'{s} {p} {o} .\n')
+                if o.startswith('_:'):
+                    todo.append(o)
+        return ''.join(lines)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,92 @@
+'''
+LDES RELATION FILTER
+Concerns of the relation filter:
+ - Restricting the crawl of a view to the members with a value of a path within a range or starting with a prefix
+ - Evaluating the tree:relation semantics (greater/less than, equal to, prefix) to decide whether the
+   subtree behind a relation can hold any such members, and only following the relations that can
+'''
+import datetime
+from decimal import Decimal, InvalidOperation
+from rdflib import Literal, URIRef
+from namespace import TREE
+from models import LdesRelation, LdesView
+
+# the largest code point, used to turn a prefix into the range of the strings starting with it
+MAX_CHARACTER = '\U0010ffff'
+
+
+def to_aware(value):
+    """Takes naive datetimes as UTC, so that they compare with timezone aware ones, other values are returned as they are."""
+    if isinstance(value, datetime.datetime) and not value.tzinfo:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+def to_comparable(value, like):
+    """Converts a filter value given as text to the type of the relation value it is compared with."""
+    if isinstance(like, datetime.datetime):
+        return to_aware(datetime.datetime.fromisoformat(value.replace('Z', '+00:00')))
+    elif isinstance(like, datetime.date):
+        return datetime.date.fromisoformat(value)
+    elif isinstance(like, (int, float, Decimal)) and not isinstance(like, bool):
+        return Decimal(value)
+    return value
+
+
+class LdesRelationFilter():
+
+    def __init__(self, path: str, min_value: str = None, max_value: str = None, prefix: str = None):
+        self.path = path
+        self.min_value = min_value
+        self.max_value = max_value
+        self.prefix = prefix
+
+    @classmethod
+    def from_view(cls, view: LdesView) -> 'LdesRelationFilter':
+        """Returns the filter of a view, None when it syncs the entire collection. The path defaults to the timestamp path,
+        a view without either is not filtered at all (see LdesManager.onboard_ldes_view).
+        """
+        if view.filter_min is None and view.filter_max is None and view.filter_prefix is None:
+            return None
+        if not (view.filter_path or view.timestamp_path):
+            return None
+        return cls(view.filter_path or view.timestamp_path, view.filter_min, view.filter_max, view.filter_prefix)
+
+    def can_match(self, relation: LdesRelation) -> bool:
+        """Tells whether the subtree behind a relation may hold members matching the filter, when in doubt it may."""
+        if relation.value is None or not relation.path or relation.path != self.path:
+            return True
+        if relation.value_datatype:
+            value = Literal(relation.value, datatype=URIRef(relation.value_datatype)).toPython()
+            # a value that is not valid for its datatype remains a literal
+            value = relation.value if isinstance(value, Literal) else to_aware(value)
+        else:
+            value = relation.value
+        try:
+            low, high = self.__get_range(value)
+            relation_type = URIRef(relation.relation_type)
+            if relation_type == TREE.GreaterThanRelation:
+                return high is None or high > value
+            elif relation_type == TREE.GreaterThanOrEqualToRelation:
+                return high is None or high >= value
+            elif relation_type == TREE.LessThanRelation:
+                return low is None or low < value
+            elif relation_type == TREE.LessThanOrEqualToRelation:
+                return low is None or low <= value
+            elif relation_type == TREE.EqualToRelation:
+                return (low is None or low <= value) and (high is None or value <= high)
+            elif relation_type == TREE.PrefixRelation and isinstance(value, str):
+                # the subtree holds the strings starting with value, they overlap with the range if its prefix does
+                return (high is None or value <= high) and (low is None or value + MAX_CHARACTER >= low)
+        except (TypeError, ValueError, InvalidOperation):
+            # values that cannot be compared (different types, unparsable filter values) do not prune anything
+            pass
+        return True
+
+    def __get_range(self, like):
+        """Returns the (inclusive) range of values the filter matches, converted to the type of like, None for an open end."""
+        low = to_comparable(self.min_value, like) if self.min_value is not None else None
+        high = to_comparable(self.max_value, like) if self.max_value is not None else None
+        if self.prefix is not None and isinstance(like, str):
+            low = max(low, self.prefix) if low is not None else self.prefix
+            high = min(high, self.prefix + MAX_CHARACTER) if high is not None else self.prefix + MAX_CHARACTER
+        return low, high
@@ -0,0 +1,165 @@
+'''
+LDES SCHEDULER
+Concerns of the LDES scheduler:
+ - Deciding when a node is polled next, based on how often it was observed to change and on its cache expiry
+ - Pacing the requests against a single host, and holding them back while the host asked to retry later
+ - Parking a host that keeps failing (circuit breaking), instead of sending it requests that are bound to fail
+'''
+import datetime
+import threading
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+from models import LdesNode
+
+
+class LdesPollingPolicy():
+    """Adapts the polling interval of a node to its observed change rate.
+
+    A node starts at min_interval (the view's polling interval), every unmodified response multiplies its interval
+    by backoff up to max_interval, and every changed response multiplies it by speedup down to min_interval again.
+    """
+
+    def __init__(self, min_interval: int, max_interval: int = 3600, backoff: float = 2.0, speedup: float = 0.5):
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval or self.min_interval)
+        self.backoff = backoff
+        self.speedup = speedup
+
+    def next_interval(self, previous: int, is_changed: bool) -> int:
+        if not previous:
+            return self.min_interval
+        interval = previous * (self.speedup if is_changed else self.backoff)
+        return int(min(self.max_interval, max(self.min_interval, interval)))
+
+    def schedule(self, node: LdesNode, previous: int, is_changed: bool, now: datetime.datetime = None):
+        """Sets the polling interval and next poll deadline of a node that was just polled, never before its cache expiry."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        node.poll_interval = self.next_interval(previous, is_changed)
+        node.next_poll = now + datetime.timedelta(seconds=node.poll_interval)
+        if node.expires and node.expires > node.next_poll:
+            node.next_poll = node.expires
+
+
+class LdesRateLimiter():
+    """Limits the number of requests per second against every host, shared by all clients of the process.
+
+    Every host has a token bucket holding up to burst requests, refilled at max_requests_per_second, so that a host
+    that was idle for a while accepts a short burst of requests before they are paced.
+    """
+
+    def __init__(self, max_requests_per_second: float = 0, burst: int = 1):
+        self.rate = max_requests_per_second or 0
+        self.burst = max(1, burst or 1)
+        # the tokens left in the bucket of a host, and the (monotonic) time they were counted
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        # the (monotonic) time until which a host asked not to be requested
+        self.deferred: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, location: str):
+        """Blocks until a request to the host of location fits in its rate."""
+        if not self.rate:
+            return
+        host = urlparse(location).netloc
+        with self.lock:
+            now = time.monotonic()
+            tokens, counted = self.buckets.get(host, (self.burst, now))
+            # the token is taken right away, a negative balance queues the request behind the ones already waiting
+            tokens = min(self.burst, tokens + (now - counted) * self.rate) - 1
+            self.buckets[host] = (tokens, now)
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+    def defer(self, location: str, seconds: float):
+        """Holds back the requests to the host of location, as asked for by a Retry-After header."""
+        host = urlparse(location).netloc
+        with self.lock:
+            self.deferred[host] = max(self.deferred.get(host, 0), time.monotonic() + seconds)
+
+    def get_delay(self, location: str) -> float:
+        """Returns the number of seconds the host of location is deferred for, 0 when it accepts requests."""
+        host = urlparse(location).netloc
+        with self.lock:
+            delay = self.deferred.get(host, 0) - time.monotonic()
+            if delay <= 0:
+                self.deferred.pop(host, None)
+                return 0
+            return delay
+
+
+class LdesCircuitBreaker():
+    """Parks a host that keeps failing, shared by all clients of the process.
+
+    After failure_threshold consecutive failed requests (each after its retries) the circuit of the host opens, and the
+    host is not requested for cooldown seconds. Then a single probe request is let through: the circuit closes again when
+    it succeeds, and opens for twice the previous cooldown (up to max_cooldown) when it fails. A threshold of 0 never opens.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 60, max_cooldown: float = 3600):
+        self.failure_threshold = failure_threshold or 0
+        self.cooldown = max(1, cooldown or 1)
+        self.max_cooldown = max(self.cooldown, max_cooldown or self.cooldown)
+        # the number of consecutive failures of a host
+        self.failures: Dict[str, int] = {}
+        # the (monotonic) time until which the circuit of a host is open, and the cooldown it was opened for
+        self.open_until: Dict[str, float] = {}
+        self.cooldowns: Dict[str, float] = {}
+        # the hosts of which the probe request is under way, and the thread sending it
+        self.probing: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def get_delay(self, location: str) -> float:
+        """Returns the number of seconds the circuit of the host of location stays open, 0 when it may be requested.
+
+        Once the cooldown passed, the first caller gets 0 and sends the probe, the others wait for its outcome.
+        """
+        host = urlparse(location).netloc
+        with self.lock:
+            if host not in self.open_until:
+                return 0
+            delay = self.open_until[host] - time.monotonic()
+            if delay > 0:
+                return delay
+            if host in self.probing:
+                return self.cooldowns[host]
+            self.probing[host] = threading.get_ident()
+            return 0
+
+    def is_probing(self, location: str) -> bool:
+        """Tells whether the current thread sends the probe of the host of location, a probe request is not retried."""
+        with self.lock:
+            return self.probing.get(urlparse(location).netloc) == threading.get_ident()
+
+    def release_probe(self, location: str):
+        """Hands the probe of the host of location to the next request, when the current thread neither recorded a success nor a failure."""
+        host = urlparse(location).netloc
+        with self.lock:
+            if self.probing.get(host) == threading.get_ident():
+                del self.probing[host]
+
+    def record_success(self, location: str):
+        """Closes the circuit of the host of location, it answered a request."""
+        host = urlparse(location).netloc
+        with self.lock:
+            self.failures.pop(host, None)
+            self.open_until.pop(host, None)
+            self.cooldowns.pop(host, None)
+            self.probing.pop(host, None)
+
+    def record_failure(self, location: str) -> float:
+        """Counts a failed request to the host of location, returns the cooldown when it opened the circuit, 0 otherwise."""
+        host = urlparse(location).netloc
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if host in self.probing:
+                del self.probing[host]
+                cooldown = min(self.max_cooldown, self.cooldowns[host] * 2)
+            elif self.failure_threshold and self.failures[host] >= self.failure_threshold and host not in self.open_until:
+                cooldown = self.cooldown
+            else:
+                # requests sent before the circuit opened do not extend its cooldown
+                return 0
+            self.cooldowns[host] = cooldown
+            self.open_until[host] = time.monotonic() + cooldown
+            return cooldown
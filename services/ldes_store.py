@@ -1,11 +1,16 @@
+import datetime
+import functools
 import sqlite3
 from sqlite3 import Error
 import os
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Tuple
 
-from models import LdesNode, LdesView, LdesRelation
+from models import LdesNode, LdesView, LdesRelation, LdesMember
+from rdflib import Literal, XSD
 from ldes_client_error import LdesClientError
+from services.ldes_codec import PayloadCodec, create_codec, train_dictionary
 
 VIEWS_TABLE= \
 """
@@ -44,34 +49,314 @@ CREATE TABLE IF NOT EXISTS relations (
 )
 """
 
+MEMBERS_TABLE= \
+"""
+CREATE TABLE IF NOT EXISTS members (
+    uri VARCHAR(2048) PRIMARY KEY,
+    node_uri VARCHAR(2048) NOT NULL,
+    version_of VARCHAR(2048),
+    timestamp DATETIME,
+    payload TEXT,
+    FOREIGN KEY (node_uri) REFERENCES nodes(uri)
+)
+"""
+
+SEQUENCES_TABLE= \
+"""
+CREATE TABLE IF NOT EXISTS sequences (
+    name VARCHAR(100) PRIMARY KEY,
+    seq INTEGER DEFAULT 0 NOT NULL
+)
+"""
+
+CONSUMERS_TABLE= \
+"""
+CREATE TABLE IF NOT EXISTS consumers (
+    name VARCHAR(100) PRIMARY KEY,
+    seq INTEGER DEFAULT 0 NOT NULL,
+    updated DATETIME
+)
+"""
+
+LATEST_VERSIONS_TABLE= \
+"""
+CREATE TABLE IF NOT EXISTS latest_versions (
+    version_of VARCHAR(2048) PRIMARY KEY,
+    member_uri VARCHAR(2048) NOT NULL,
+    timestamp DATETIME,
+    seq INTEGER NOT NULL,
+    FOREIGN KEY (member_uri) REFERENCES members(uri)
+)
+"""
+
+# upserts the latest version of the entities of the selected members, the latest version being the one with the
+# ... highest timestamp (members without one come first) and, for equal timestamps, the one that was stored last
+LATEST_VERSIONS_UPSERT = \
+"""
+INSERT INTO latest_versions(version_of, member_uri, timestamp, seq)
+SELECT version_of, uri, timestamp, seq FROM members WHERE version_of IS NOT NULL AND {condition} ORDER BY seq
+ON CONFLICT(version_of) DO UPDATE SET member_uri=excluded.member_uri, timestamp=excluded.timestamp, seq=excluded.seq
+WHERE IFNULL(excluded.timestamp, '') > IFNULL(latest_versions.timestamp, '') 
+    OR (IFNULL(excluded.timestamp, '') = IFNULL(latest_versions.timestamp, '') AND excluded.seq > latest_versions.seq)
+"""
+
+DICTIONARIES_TABLE= \
+"""
+CREATE TABLE IF NOT EXISTS dictionaries (
+    codec VARCHAR(20) PRIMARY KEY,
+    data BLOB NOT NULL
+)
+"""
+
+NODE_COLUMNS = 'uri, location, view_uri, payload, etag, expires, immutable, next_poll, poll_interval, last_modified, content_hash, content_type'
+
+# the columns nodes are read with, their payload is only loaded when it is used (see row_to_node)
+NODE_HEADER_COLUMNS = NODE_COLUMNS.replace('payload, ', '')
+
+RELATION_COLUMNS = 'source_node, relation_type, target_location, target_node_uri, is_processed, path, value, value_datatype'
+
+# schema migrations applied to alias databases in order, the number of applied migrations is kept in PRAGMA user_version
+# IMPORTANT: only ever append to this list, existing databases rely on the position of each migration
+MIGRATIONS = [
+    # (1) secondary indexes for the polling work queues, partial so that they only hold pending rows
+    [
+        'CREATE INDEX IF NOT EXISTS nodes_mutable_idx ON nodes(immutable) WHERE immutable=0',
+        'CREATE INDEX IF NOT EXISTS relations_pending_idx ON relations(is_processed) WHERE is_processed=0',
+        'CREATE INDEX IF NOT EXISTS relations_target_location_idx ON relations(target_location)',
+    ],
+    # (2) members extracted from the fragments, keyed (and thereby deduplicated) by member IRI
+    [
+        'ALTER TABLE views ADD COLUMN version_of_path VARCHAR(2048)',
+        'ALTER TABLE views ADD COLUMN timestamp_path VARCHAR(2048)',
+        MEMBERS_TABLE,
+        'CREATE INDEX IF NOT EXISTS members_version_of_idx ON members(version_of)',
+        'CREATE INDEX IF NOT EXISTS members_timestamp_idx ON members(timestamp)',
+    ],
+    # (3) monotonically increasing member sequence numbers and the named consumer cursors into them
+    [
+        'ALTER TABLE members ADD COLUMN seq INTEGER',
+        'UPDATE members SET seq=rowid',
+        'CREATE UNIQUE INDEX IF NOT EXISTS members_seq_idx ON members(seq)',
+        CONSUMERS_TABLE,
+    ],
+    # (4) trained dictionaries of the payload codecs
+    [
+        DICTIONARIES_TABLE,
+    ],
+    # (5) adaptive polling: the next poll deadline and current polling interval per node, the index serves as priority queue
+    [
+        'ALTER TABLE nodes ADD COLUMN next_poll DATETIME',
+        'ALTER TABLE nodes ADD COLUMN poll_interval INT',
+        "UPDATE nodes SET next_poll=COALESCE(expires, datetime('now'))",
+        'CREATE INDEX IF NOT EXISTS nodes_next_poll_idx ON nodes(next_poll) WHERE immutable=0',
+        'CREATE INDEX IF NOT EXISTS nodes_location_idx ON nodes(location)',
+    ],
+    # (6) relations keyed by their target as well, a node may have several relations of the same type
+    [
+        RELATIONS_TABLE.replace('relations (', 'relations_v6 (').replace('PRIMARY KEY (source_node, relation_type)', 'PRIMARY KEY (source_node, relation_type, target_location)'),
+        'INSERT INTO relations_v6 SELECT source_node, relation_type, target_location, target_node_uri, is_processed FROM relations',
+        'DROP TABLE relations',
+        'ALTER TABLE relations_v6 RENAME TO relations',
+        'CREATE INDEX IF NOT EXISTS relations_pending_idx ON relations(is_processed) WHERE is_processed=0',
+        'CREATE INDEX IF NOT EXISTS relations_target_location_idx ON relations(target_location)',
+    ],
+    # (7) tree:path and tree:value of the relations, and the filter of a view restricting the crawl to the subtrees it can match
+    [
+        'ALTER TABLE relations ADD COLUMN path VARCHAR(2048)',
+        'ALTER TABLE relations ADD COLUMN value TEXT',
+        'ALTER TABLE relations ADD COLUMN value_datatype VARCHAR(2048)',
+        'ALTER TABLE views ADD COLUMN filter_path VARCHAR(2048)',
+        'ALTER TABLE views ADD COLUMN filter_min TEXT',
+        'ALTER TABLE views ADD COLUMN filter_max TEXT',
+        'ALTER TABLE views ADD COLUMN filter_prefix TEXT',
+    ],
+    # (8) the JSON-LD frame of the members, as described by the view
+    [
+        'ALTER TABLE views ADD COLUMN member_frame TEXT',
+    ],
+    # (9) the latest version of every entity, maintained as members are stored
+    [
+        LATEST_VERSIONS_TABLE,
+        LATEST_VERSIONS_UPSERT.format(condition='1=1'),
+    ],
+    # (10) retention policies of the view, and the index used to find the fragments left without members
+    [
+        'ALTER TABLE views ADD COLUMN retention_period VARCHAR(50)',
+        'ALTER TABLE views ADD COLUMN retention_versions INT',
+        'CREATE INDEX IF NOT EXISTS members_node_uri_idx ON members(node_uri)',
+    ],
+    # (11) the Last-Modified validator and body hash of the last response of a node, next to its etag
+    [
+        'ALTER TABLE nodes ADD COLUMN last_modified VARCHAR(50)',
+        'ALTER TABLE nodes ADD COLUMN content_hash VARCHAR(64)',
+    ],
+    # (12) the Accept header of the view, and the format the payload of every node was received in
+    [
+        'ALTER TABLE views ADD COLUMN accept VARCHAR(500)',
+        'ALTER TABLE nodes ADD COLUMN content_type VARCHAR(100)',
+    ],
+    # (13) views stopped on request, which the daemon leaves alone until they are synced or resumed explicitly
+    [
+        'ALTER TABLE views ADD COLUMN stopped INT DEFAULT 0 NOT NULL',
+    ],
+    # (14) the highest member sequence number ever handed out, so that deleting the latest members does not reuse theirs
+    [
+        SEQUENCES_TABLE,
+        "INSERT OR IGNORE INTO sequences(name, seq) SELECT 'members', IFNULL(MAX(seq), 0) FROM members",
+    ],
+    # (15) the IRIs of the members deleted by the garbage collection, which are not stored again when their fragment is refetched
+    [
+        'CREATE TABLE IF NOT EXISTS deleted_members (uri VARCHAR(2048) PRIMARY KEY) WITHOUT ROWID',
+    ],
+]
+
+# pragmas applied once to the long-lived store connection:
+#  - incremental auto_vacuum lets the retention garbage collection hand back freed pages in small steps, it only applies
+#    to new databases and to existing ones after their next VACUUM (see `ldes compact`)
+#  - WAL lets a `stop` from another process read the views table while a sync is writing
+#  - synchronous=NORMAL only fsyncs at WAL checkpoints, which is safe in WAL mode
+#  - a negative cache_size is expressed in KiB (here 64MB of page cache)
+CONNECTION_PRAGMAS = [
+    'PRAGMA auto_vacuum=INCREMENTAL',
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA temp_store=MEMORY',
+]
+
+# datetimes are stored as UTC text in the format of SQLite's datetime('now'), so they compare in SQL
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def to_db_datetime(value: datetime.datetime) -> str:
+    if value is None:
+        return None
+    if value.tzinfo:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.strftime(DATETIME_FORMAT)
+
+def from_db_datetime(value: str) -> datetime.datetime:
+    if value is None:
+        return None
+    return datetime.datetime.strptime(value, DATETIME_FORMAT).replace(tzinfo=datetime.timezone.utc)
+
+# member timestamps keep their sub-second precision, as versions of an entity may be only milliseconds apart
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+def to_db_timestamp(value) -> str:
+    if not isinstance(value, datetime.datetime):
+        return value
+    if value.tzinfo:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.strftime(TIMESTAMP_FORMAT)
+
+def from_db_timestamp(value: str) -> datetime.datetime:
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        # not a date time literal, returned as stored
+        return value
+
+def parse_retention_period(value: str) -> datetime.timedelta:
+    """Parses a retention period given as xsd:duration, like P30D."""
+    period = Literal(value, datatype=XSD.duration).toPython()
+    if isinstance(period, Literal):
+        raise LdesClientError(f'Invalid retention period {value}, expected an xsd:duration like P30D.')
+    return period
+
+# compressed payloads are stored as blobs prefixed with the name of their codec, plain payloads as text
+CODEC_SEPARATOR = b'\x00'
+
 class LdesStore():
 
-    def __init__(self, location: str, alias: str):
+    def __init__(self, location: str, alias: str, codec: str = None):
         self.alias = alias
         self.location = location
         self.connection_string = f'{self.location}/{alias}.db'
+        self.connection = None
+        self.transaction_depth = 0
+        # name of the codec new payloads are written with, see encode_payload()
+        self.codec_name = codec if codec != 'none' else None
+        self.codecs = {}
+        self.latest_dictionary = None
 
     def get_connection(self):
-        conn = sqlite3.connect(self.connection_string)
-        return conn
+        if not self.connection:
+            # autocommit mode: transactions are demarcated explicitly through transaction()
+            # the connection may move between threads (e.g. the daemon's workers) but is never used by two at once
+            conn = sqlite3.connect(self.connection_string, isolation_level=None, check_same_thread=False)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self.connection = conn
+            self.migrate_view_db()
+        return self.connection
+
+    def migrate_view_db(self):
+        """Brings the schema of an existing alias database up to date by applying any pending MIGRATIONS."""
+        conn = self.get_connection()
+        try:
+            if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='views'").fetchone():
+                # not created yet, create_view_db() migrates the new database
+                return
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for index, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                with self.transaction() as cursor:
+                    for statement in migration:
+                        cursor.execute(statement)
+                    cursor.execute(f'PRAGMA user_version={index}')
+        except Error as err:
+            raise LdesClientError(f'Could not migrate the collection database {self.connection_string}.', err)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+            self.transaction_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        """Unit of work on the store connection, committed as a whole when the outermost block exits.
+
+        Nested blocks are mapped onto savepoints so that they can be rolled back on their own.
+        """
+        conn = self.get_connection()
+        savepoint = f'sp_{self.transaction_depth}'
+        try:
+            conn.execute('BEGIN' if self.transaction_depth == 0 else f'SAVEPOINT {savepoint}')
+        except Error as err:
+            raise LdesClientError(err)
+        self.transaction_depth += 1
+        try:
+            yield conn.cursor()
+        except BaseException:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                conn.execute('ROLLBACK')
+            else:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+            raise
+        else:
+            self.transaction_depth -= 1
+            try:
+                conn.execute('COMMIT' if self.transaction_depth == 0 else f'RELEASE {savepoint}')
+            except Error as err:
+                raise LdesClientError(err)
 
     def create_view_db(self):
         if not os.path.exists(self.connection_string):
             if not os.path.exists(self.location):
                 os.makedirs(self.location)
 
-            conn = None
             try:
-                conn = sqlite3.connect(self.connection_string)
-                cursor =  conn.cursor()
-                cursor.execute(VIEWS_TABLE)
-                cursor.execute(NODES_TABLE)
-                cursor.execute(RELATIONS_TABLE)
+                with self.transaction() as cursor:
+                    cursor.execute(VIEWS_TABLE)
+                    cursor.execute(NODES_TABLE)
+                    cursor.execute(RELATIONS_TABLE)
             except Error as e:
                 raise LdesClientError("Could not create view database.", e)
-            finally:
-                if conn:
-                    conn.close()
+            self.migrate_view_db()
         else:
             raise LdesClientError(f'The collection database {self.connection_string} already exists.')
 
@@ -79,49 +364,117 @@ class LdesStore():
         if not os.path.exists(self.connection_string):
             raise LdesClientError(f'The collection database {self.connection_string} does not exist.')
         else:
+            self.close()
             os.remove(self.connection_string)
+            # WAL mode leaves its side files next to the database
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(self.connection_string + suffix):
+                    os.remove(self.connection_string + suffix)
+
+    #region *** PAYLOAD Functions ***
+    def get_codec(self, name: str) -> PayloadCodec:
+        if name not in self.codecs:
+            self.codecs[name] = create_codec(name, self.get_dictionary(name) if name.startswith('zstd-dict:') else None)
+        return self.codecs[name]
+
+    def encode_payload(self, payload: str, codec_name: str = None):
+        name = codec_name or self.codec_name
+        if payload is None or not name or name == 'none':
+            return payload
+        if name == 'zstd-dict':
+            # payloads are written with the most recently trained dictionary, older ones are kept to decode older payloads
+            name = self.get_latest_dictionary()
+        codec = self.get_codec(name)
+        return codec.name.encode() + CODEC_SEPARATOR + codec.encode(payload)
+
+    def decode_payload(self, value) -> str:
+        if not isinstance(value, bytes):
+            return value
+        name, _, data = value.partition(CODEC_SEPARATOR)
+        return self.get_codec(name.decode()).decode(data)
+
+    def get_dictionary(self, codec: str) -> bytes:
+        try:
+            record = self.get_connection().execute('SELECT data FROM dictionaries WHERE codec=?', (codec,)).fetchone()
+            if not record:
+                raise LdesClientError(f'The payload dictionary {codec} does not exist.')
+            return record[0]
+        except Error as err:
+            raise LdesClientError(err)
+
+    def get_latest_dictionary(self) -> str:
+        if not self.latest_dictionary:
+            try:
+                record = self.get_connection().execute('SELECT codec FROM dictionaries ORDER BY rowid DESC LIMIT 1').fetchone()
+            except Error as err:
+                raise LdesClientError(err)
+            if not record:
+                raise LdesClientError('The zstd-dict payload codec requires a trained dictionary, run ldes compact with --dictionary first.')
+            self.latest_dictionary = record[0]
+        return self.latest_dictionary
+
+    def compact(self, codec: str = None, dictionary: bool = False, batch_size: int = 500, samples: int = 2000):
+        """Re-encodes all stored payloads with the given codec (by default the store's), and reclaims the freed space.
+
+        With dictionary, a zstd dictionary is first trained on a sample of the collection's payloads.
+        """
+        codec = codec or self.codec_name or 'none'
+        try:
+            if dictionary:
+                if codec not in ('zstd', 'zstd-dict'):
+                    raise LdesClientError('A payload dictionary can only be trained for the zstd codec.')
+                cursor = self.get_connection().cursor()
+                cursor.execute('SELECT payload FROM nodes ORDER BY random() LIMIT ?', (samples,))
+                trained = train_dictionary([self.decode_payload(payload) for payload, in cursor.fetchall() if payload])
+                with self.transaction() as cursor:
+                    cursor.execute('INSERT INTO dictionaries(codec, data) VALUES (?, ?)', (create_codec('zstd-dict', trained).name, trained))
+                self.latest_dictionary = None
+                codec = 'zstd-dict'
+            for table in ('nodes', 'members'):
+                after = 0
+                while True:
+                    rows = self.get_connection().execute(f'SELECT rowid, payload FROM {table} WHERE rowid>? ORDER BY rowid LIMIT ?', (after, batch_size)).fetchall()
+                    if not rows:
+                        break
+                    with self.transaction() as cursor:
+                        cursor.executemany(f'UPDATE {table} SET payload=? WHERE rowid=?', 
+                            [(self.encode_payload(self.decode_payload(payload), codec), rowid) for rowid, payload in rows])
+                    after = rows[-1][0]
+            self.get_connection().execute('VACUUM')
+        except Error as err:
+            raise LdesClientError(err)
+
+    #endregion
 
     #region *** VIEW Functions ***
     def create_view(self, view: LdesView):
-        conn = None
-        try: 
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM views')
-            data=cursor.fetchall()
-            if len(data) == 0:
-                cursor.execute('INSERT INTO views(uri, location, alias, polling, sync) VALUES (?, ?, ?, ?, ?)', view.to_tuple())
-            conn.commit()
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('SELECT * FROM views')
+                data=cursor.fetchall()
+                if len(data) == 0:
+                    cursor.execute('''INSERT INTO views(uri, location, alias, polling, sync, version_of_path, timestamp_path, filter_path, filter_min, filter_max, filter_prefix, 
+                        member_frame, retention_period, retention_versions, accept, stopped) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', view.to_tuple())
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
     def update_view(self, view: LdesView):
-        conn = None
-        try: 
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''UPDATE views SET polling=?,sync=? WHERE uri=?''', (view.polling, view.sync, view.uri))
-            conn.commit()
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''UPDATE views SET polling=?,sync=?,stopped=? WHERE uri=?''', (view.polling, view.sync, view.stopped, view.uri))
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
     def get_view(self) -> LdesView:
-        conn = None
-        try: 
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT uri, location, alias, polling, sync FROM views')
-            uri, location, alias, polling, sync = cursor.fetchone()
-            the_view = LdesView(uri, location, alias, polling, sync)
-            return the_view
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('''SELECT uri, location, alias, polling, sync, version_of_path, timestamp_path, filter_path, filter_min, filter_max, filter_prefix, 
+                member_frame, retention_period, retention_versions, accept, stopped FROM views''')
+            record = cursor.fetchone()
+            # a database without a view is left behind by an onboarding that failed halfway
+            return LdesView(*record) if record else None
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
     def delete_view(self, alias):
         raise LdesClientError("Deleting a view is not supported.")
@@ -130,158 +483,402 @@ class LdesStore():
 
     #region *** NODE Functions ***
     def create_node(self, node: LdesNode):
-        conn = None
-        try: 
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO nodes(uri, location, view_uri, payload, etag, expires, immutable) VALUES (?,?,?,?,?, ?,?)', node.to_tuple())
-            conn.commit()
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(f'''INSERT INTO nodes({NODE_COLUMNS}) VALUES (?,?,?,?,?, ?,?,COALESCE(?, datetime('now')),?,?, ?,?)''', 
+                    (node.uri, node.location, node.view_uri, self.encode_payload(node.payload), node.etag, to_db_datetime(node.expires), node.immutable, 
+                     to_db_datetime(node.next_poll), node.poll_interval, node.last_modified, node.content_hash, node.content_type))
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
     def update_node(self, node: LdesNode):
-        conn = None
-        try: 
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''UPDATE nodes SET payload=?,etag=?,expires=?,immutable=? WHERE uri=?''', (node.payload, node.etag, node.expires, node.immutable, node.uri))
-            conn.commit()
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''UPDATE nodes SET payload=?,etag=?,expires=?,immutable=?,next_poll=COALESCE(?, next_poll),poll_interval=?,last_modified=?,content_hash=?,content_type=? WHERE uri=?''', 
+                    (self.encode_payload(node.payload), node.etag, to_db_datetime(node.expires), node.immutable, to_db_datetime(node.next_poll), node.poll_interval, 
+                     node.last_modified, node.content_hash, node.content_type, node.uri))
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
-    def get_nodes(self, mutable_only: bool = False) -> List[LdesNode]:
-        conn = None
+    def update_node_schedule(self, node: LdesNode):
+        """Updates the validators, cache expiry, immutability and polling schedule of an unchanged node, leaving its payload untouched."""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            result = []
+            with self.transaction() as cursor:
+                cursor.execute('''UPDATE nodes SET etag=?,last_modified=?,content_hash=?,expires=?,immutable=?,next_poll=?,poll_interval=? WHERE uri=?''', 
+                    (node.etag, node.last_modified, node.content_hash, to_db_datetime(node.expires), node.immutable, to_db_datetime(node.next_poll), node.poll_interval, node.uri))
+        except Error as err:
+            raise LdesClientError(err)
+
+    def get_nodes(self, mutable_only: bool = False, expired_only: bool = False) -> Iterator[LdesNode]:
+        """Iterates over the stored nodes, optionally only the mutable ones and/or the ones whose cache expiry has passed."""
+        try:
+            cursor = self.get_connection().cursor()
+            conditions = []
             if mutable_only:
-                cursor.execute('SELECT uri, location, view_uri, payload, etag, expires, immutable FROM nodes WHERE immutable=0')
-                records = cursor.fetchall()
-                for row in records:
-                    uri, location, view_uri, payload, etag, expires, immutable = row
-                    result.append(LdesNode(uri, location, view_uri, payload, etag, expires, immutable))
-            else:
-                cursor.execute('SELECT uri, location, view_uri, payload, etag, expires, immutable FROM nodes')
-                records = cursor.fetchall()
-                for row in records:
-                    uri, location, view_uri, payload, etag, expires, immutable = row
-                    result.append(LdesNode(uri, location, view_uri, payload, etag, expires, immutable))
-            return result
+                conditions.append('immutable=0')
+            if expired_only:
+                conditions.append("(expires IS NULL OR expires <= datetime('now'))")
+            where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+            cursor.execute(f'SELECT {NODE_HEADER_COLUMNS} FROM nodes{where}')
+            for row in cursor:
+                yield self.row_to_node(row)
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
+
+    def get_pending_nodes(self, limit: int, after: Tuple[str, int] = None, due: datetime.datetime = None) -> Tuple[List[LdesNode], Tuple[str, int]]:
+        """Returns the next page of at most limit mutable nodes that are due for polling at due (now by default), most overdue first.
+
+        The nodes are taken from the priority queue formed by the (partial) index on nodes.next_poll. The returned
+        cursor is passed as after to get the next page, an empty page means there is no pending work left. The pages
+        of a single pass should share their due time, or else the nodes rescheduled meanwhile turn up again.
+        """
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f'''SELECT rowid, {NODE_HEADER_COLUMNS} FROM nodes 
+                WHERE immutable=0 AND next_poll <= COALESCE(?, datetime('now')) AND (next_poll, rowid) > (?, ?) ORDER BY next_poll, rowid LIMIT ?''', 
+                (to_db_datetime(due), *(after or ('', 0)), limit))
+            result = []
+            for rowid, *row in cursor.fetchall():
+                result.append(self.row_to_node(row))
+                after = (row[6], rowid)
+            return result, after
+        except Error as err:
+            raise LdesClientError(err)
+
+    def iter_pending_nodes(self, batch_size: int = 1000, due: datetime.datetime = None) -> Iterator[LdesNode]:
+        """Iterates the nodes that are due at due, the time the iteration started by default."""
+        due = due or datetime.datetime.now(datetime.timezone.utc)
+        after = None
+        while True:
+            nodes, after = self.get_pending_nodes(batch_size, after, due)
+            if not nodes:
+                return
+            yield from nodes
 
     def get_node(self, node_uri: str) -> LdesNode:
-        conn = None
-        try: 
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT uri, location, view_uri, payload, etag, expires, immutable FROM nodes WHERE uri=?', (node_uri,))
-            records = cursor.fetchall()
-            if len(records) > 0:
-                uri, location, view_uri, payload, etag, expires, immutable = records[0]
-                the_node = LdesNode(uri, location, view_uri, payload, etag, expires, immutable)
-                return the_node
-            else:
-                return None
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f'SELECT {NODE_HEADER_COLUMNS} FROM nodes WHERE uri=?', (node_uri,))
+            record = cursor.fetchone()
+            return self.row_to_node(record) if record else None
+        except Error as err:
+            raise LdesClientError(err)
+
+    def get_node_at(self, location: str) -> LdesNode:
+        """Returns the node stored for a location, like the root node of the view."""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f'SELECT {NODE_HEADER_COLUMNS} FROM nodes WHERE location=? LIMIT 1', (location,))
+            record = cursor.fetchone()
+            return self.row_to_node(record) if record else None
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
+
+    def get_next_poll(self) -> datetime.datetime:
+        """Returns the earliest poll deadline of the mutable nodes, None when there are none."""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('SELECT MIN(next_poll) FROM nodes WHERE immutable=0')
+            return from_db_datetime(cursor.fetchone()[0])
+        except Error as err:
+            raise LdesClientError(err)
+
+    def get_node_payload(self, node_uri: str) -> str:
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('SELECT payload FROM nodes WHERE uri=?', (node_uri,))
+            record = cursor.fetchone()
+            return self.decode_payload(record[0]) if record else None
+        except Error as err:
+            raise LdesClientError(err)
+
+    def row_to_node(self, row) -> LdesNode:
+        """Turns a row of NODE_HEADER_COLUMNS into a node, which loads (and decodes) its payload when it is first used."""
+        uri, location, view_uri, etag, expires, immutable, next_poll, poll_interval, last_modified, content_hash, content_type = row
+        return LdesNode(uri, location, view_uri, functools.partial(self.get_node_payload, uri), etag, from_db_datetime(expires), immutable, 
+            from_db_datetime(next_poll), poll_interval, last_modified, content_hash, content_type)
 
     #endregion
 
     #region *** RELATION Functions ***
-    def get_relation(self, node_uri: str, relation_type: str):
-        conn = None
-        try: 
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM relations WHERE source_node=? AND relation_type=?', (node_uri,relation_type,))
-            records = cursor.fetchall()
-            if len(records) > 0:
-                source_node, relation_type, target_location, target_node_uri, is_processed = records[0]
-                the_relation = LdesRelation(source_node, relation_type, target_location, target_node_uri, is_processed)
-                return the_relation
-            else:
-                return None
+    def get_relation(self, node_uri: str, relation_type: str, target_location: str):
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f'''SELECT {RELATION_COLUMNS} FROM relations 
+                WHERE source_node=? AND relation_type=? AND target_location=?''', (node_uri, relation_type, target_location,))
+            record = cursor.fetchone()
+            return LdesRelation(*record) if record else None
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
         
 
     def get_relations(self, unprocessed_only=False) -> List[LdesRelation]:
-        conn = None
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_connection().cursor()
+            where = ' WHERE is_processed=0' if unprocessed_only else ''
+            cursor.execute(f'SELECT {RELATION_COLUMNS} FROM relations{where}')
+            return [LdesRelation(*row) for row in cursor.fetchall()]
+        except Error as err:
+            raise LdesClientError(err)
+
+
+    def get_pending_relations(self, limit: int, after: int = 0) -> Tuple[List[LdesRelation], int]:
+        """Returns the next page of at most limit unprocessed relations after the given cursor, see get_pending_nodes."""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f'''SELECT rowid, {RELATION_COLUMNS} FROM relations 
+                WHERE is_processed=0 AND rowid>? ORDER BY rowid LIMIT ?''', (after, limit))
             result = []
-            if unprocessed_only:
-                cursor.execute('SELECT source_node, relation_type, target_location, target_node_uri, is_processed FROM relations WHERE is_processed=0')
-                records = cursor.fetchall()
-                for row in records:
-                    source_node, relation_type, target_location, target_node_uri, is_processed = row
-                    result.append(LdesRelation(source_node, relation_type, target_location, target_node_uri, is_processed))
+            for after, *row in cursor.fetchall():
+                result.append(LdesRelation(*row))
+            return result, after
+        except Error as err:
+            raise LdesClientError(err)
+
+    def iter_pending_relations(self, batch_size: int = 1000) -> Iterator[LdesRelation]:
+        after = 0
+        while True:
+            relations, after = self.get_pending_relations(batch_size, after)
+            if not relations:
+                return
+            yield from relations
+
+    def get_node_relations(self, node_uri: str) -> List[LdesRelation]:
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f'SELECT {RELATION_COLUMNS} FROM relations WHERE source_node=?', (node_uri,))
+            return [LdesRelation(*row) for row in cursor.fetchall()]
+        except Error as err:
+            raise LdesClientError(err)
+
+    def create_relation(self, rel: LdesRelation):
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(f'INSERT INTO relations({RELATION_COLUMNS}) VALUES (?,?,?,?,?, ?,?,?)', rel.to_tuple())
+        except Error as err:
+            raise LdesClientError(err)
+
+    def update_relation(self, rel: LdesRelation):
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''UPDATE relations SET is_processed=?, target_node_uri=COALESCE(?, target_node_uri) 
+                    WHERE source_node=? AND relation_type=? AND target_location=?''', 
+                    (rel.is_processed, rel.target_node_uri, rel.source_node, rel.relation_type, rel.target_location, ))
+        except Error as err:
+            raise LdesClientError(err)
+
+    #endregion
+
+    #region *** MEMBER Functions ***
+    def create_members(self, members: List[LdesMember]) -> int:
+        """Stores the given members and returns how many were new, members already stored through another fragment are left untouched."""
+        try:
+            with self.transaction() as cursor:
+                # every newly stored member takes the next sequence number, ignored duplicates do not consume one
+                # ... numbers of members deleted by the garbage collection are never handed out again, see the sequences table,
+                # ... and neither are those members themselves stored again, see the deleted_members table
+                cursor.executemany('''INSERT OR IGNORE INTO members(uri, node_uri, version_of, timestamp, payload, seq) 
+                    SELECT ?,?,?,?,?, (SELECT MAX(IFNULL(MAX(seq), 0), (SELECT seq FROM sequences WHERE name='members')) + 1 FROM members)
+                    WHERE NOT EXISTS (SELECT 1 FROM deleted_members WHERE uri=?)''', 
+                    [(m.uri, m.node_uri, m.version_of, to_db_timestamp(m.timestamp), self.encode_payload(m.payload), m.uri) for m in members])
+                inserted = max(cursor.rowcount, 0)
+                if inserted:
+                    cursor.execute('''UPDATE sequences SET seq=MAX(seq, (SELECT IFNULL(MAX(seq), 0) FROM members)) WHERE name='members' ''')
+                    cursor.executemany(LATEST_VERSIONS_UPSERT.format(condition='uri=?'), [(m.uri,) for m in members if m.version_of])
+                return inserted
+        except Error as err:
+            raise LdesClientError(err)
+
+    def get_member(self, member_uri: str) -> LdesMember:
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('SELECT uri, node_uri, version_of, timestamp, payload, seq FROM members WHERE uri=?', (member_uri,))
+            record = cursor.fetchone()
+            if record:
+                uri, node_uri, version_of, timestamp, payload, seq = record
+                return LdesMember(uri, node_uri, version_of, from_db_timestamp(timestamp), self.decode_payload(payload), seq)
             else:
-                cursor.execute('SELECT source_node, relation_type, target_location, target_node_uri, is_processed FROM nodes')
-                records = cursor.fetchall()
-                for row in records:
-                    source_node, relation_type, target_location, target_node_uri, is_processed = row
-                    result.append(LdesRelation(source_node, relation_type, target_location, target_node_uri, is_processed))
+                return None
+        except Error as err:
+            raise LdesClientError(err)
+
+    def get_changes(self, since: int = 0, limit: int = 1000) -> List[LdesMember]:
+        """Returns at most limit members stored after sequence number since, in the order in which they were stored."""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('SELECT uri, node_uri, version_of, timestamp, payload, seq FROM members WHERE seq>? ORDER BY seq LIMIT ?', (since, limit))
+            result = []
+            for row in cursor.fetchall():
+                uri, node_uri, version_of, timestamp, payload, seq = row
+                result.append(LdesMember(uri, node_uri, version_of, from_db_timestamp(timestamp), self.decode_payload(payload), seq))
             return result
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
+    def iter_members(self, since: int = 0, batch_size: int = 1000) -> Iterator[LdesMember]:
+        """Yields all members stored after sequence number since in the order in which they were stored, a page at a time."""
+        while True:
+            members = self.get_changes(since, batch_size)
+            if not members:
+                return
+            yield from members
+            since = members[-1].seq
 
-    def get_node_relations(self, node_uri: str) -> List[LdesRelation]:
-        conn = None
+    def get_latest_version(self, version_of: str) -> LdesMember:
+        """Returns the latest version of the entity version_of, None when no version of it was stored."""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor = self.get_connection().cursor()
+            cursor.execute('''SELECT m.uri, m.node_uri, m.version_of, m.timestamp, m.payload, m.seq FROM latest_versions l 
+                JOIN members m ON m.uri=l.member_uri WHERE l.version_of=?''', (version_of,))
+            record = cursor.fetchone()
+            if record:
+                uri, node_uri, version_of, timestamp, payload, seq = record
+                return LdesMember(uri, node_uri, version_of, from_db_timestamp(timestamp), self.decode_payload(payload), seq)
+            return None
+        except Error as err:
+            raise LdesClientError(err)
+
+    def get_latest_versions(self, limit: int = 1000, after: str = '') -> List[LdesMember]:
+        """Returns the latest versions of at most limit entities following entity IRI after, ordered by entity IRI."""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('''SELECT m.uri, m.node_uri, m.version_of, m.timestamp, m.payload, m.seq FROM latest_versions l 
+                JOIN members m ON m.uri=l.member_uri WHERE l.version_of>? ORDER BY l.version_of LIMIT ?''', (after, limit))
             result = []
-            cursor.execute('SELECT source_node, relation_type, target_location, target_node_uri, is_processed FROM relations WHERE source_node=?', (node_uri,))
-            records = cursor.fetchall()
-            for row in records:
-                source_node, relation_type, target_location, target_node_uri, is_processed = row
-                result.append(LdesRelation(source_node, relation_type, target_location, target_node_uri, is_processed))
+            for row in cursor.fetchall():
+                uri, node_uri, version_of, timestamp, payload, seq = row
+                result.append(LdesMember(uri, node_uri, version_of, from_db_timestamp(timestamp), self.decode_payload(payload), seq))
             return result
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
-    def create_relation(self, rel: LdesRelation):
-        conn = None
-        try: 
+    def iter_latest_versions(self, batch_size: int = 1000) -> Iterator[LdesMember]:
+        after = ''
+        while True:
+            members = self.get_latest_versions(batch_size, after)
+            if not members:
+                return
+            yield from members
+            after = members[-1].version_of
+
+    #endregion
+
+    #region *** CONSUMER Functions ***
+    def get_consumer_cursor(self, name: str) -> int:
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('SELECT seq FROM consumers WHERE name=?', (name,))
+            record = cursor.fetchone()
+            return record[0] if record else 0
+        except Error as err:
+            raise LdesClientError(err)
+
+    def set_consumer_cursor(self, name: str, seq: int):
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''INSERT INTO consumers(name, seq, updated) VALUES (?, ?, datetime('now')) 
+                    ON CONFLICT(name) DO UPDATE SET seq=excluded.seq, updated=excluded.updated''', (name, seq))
+        except Error as err:
+            raise LdesClientError(err)
+
+    #endregion
+
+    #region *** STATUS Functions ***
+    def get_stats(self) -> Dict[str, object]:
+        """Returns the sizes of the work queues and of the collection, and the positions of the consumers, see `ldes status`."""
+        try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO relations(source_node, relation_type, target_location, target_node_uri, is_processed) VALUES (?,?,?,?,?)', rel.to_tuple())
-            conn.commit()
+            count = lambda sql: conn.execute(sql).fetchone()[0]
+            return {
+                'nodes': count('SELECT COUNT(*) FROM nodes'),
+                'mutable_nodes': count('SELECT COUNT(*) FROM nodes WHERE immutable=0'),
+                'due_nodes': count("SELECT COUNT(*) FROM nodes WHERE immutable=0 AND next_poll <= datetime('now')"),
+                'next_poll': from_db_datetime(count('SELECT MIN(next_poll) FROM nodes WHERE immutable=0')),
+                'pending_relations': count('SELECT COUNT(*) FROM relations WHERE is_processed=0'),
+                'members': count('SELECT COUNT(*) FROM members'),
+                'entities': count('SELECT COUNT(*) FROM latest_versions'),
+                'last_seq': count("SELECT seq FROM sequences WHERE name='members'"),
+                'latest_timestamp': from_db_timestamp(count('SELECT MAX(timestamp) FROM members')),
+                'formats': dict(conn.execute('SELECT content_type, COUNT(*) FROM nodes WHERE content_type IS NOT NULL GROUP BY content_type').fetchall()),
+                'consumers': dict(conn.execute('SELECT name, seq FROM consumers ORDER BY name').fetchall()),
+            }
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
-    def update_relation(self, rel: LdesRelation):
-        conn = None
-        try: 
+    #endregion
+
+    #region *** RETENTION Functions ***
+    def collect_garbage(self, view: LdesView, batch_size: int = 1000, vacuum_pages: int = 1000) -> Tuple[int, int]:
+        """Deletes the members the retention policies of the view no longer retain, and the immutable nodes left without members.
+
+        A member is retained when any policy retains it: when its timestamp lies within the retention period of now, or when
+        it is one of the latest retention versions of its entity. Members an emitter did not deliver yet are always retained.
+        The deleted members are remembered, so that they are not stored again when a fragment holding them is fetched again.
+        Deletes in batches of batch_size, handing back vacuum_pages of free pages after each. Returns the deleted members, and
+        the fragments deleted (immutable ones) or emptied (mutable ones, which keep being polled without their payload).
+        """
+        if not view.retention_period and not view.retention_versions:
+            return 0, 0
+        columns = 'seq, timestamp'
+        conditions = []
+        params = []
+        if view.retention_period:
+            period = parse_retention_period(view.retention_period)
+            conditions.append('timestamp < ?')
+            params.append(to_db_timestamp(datetime.datetime.now(datetime.timezone.utc) - period))
+        if view.retention_versions:
+            columns += ", version_of, ROW_NUMBER() OVER (PARTITION BY version_of ORDER BY IFNULL(timestamp, '') DESC, seq DESC) AS version_rank"
+            conditions.append('version_of IS NOT NULL AND version_rank > ?')
+            params.append(view.retention_versions)
+        try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''UPDATE relations SET is_processed=? WHERE source_node=? AND relation_type=?''', (rel.is_processed, rel.source_node, rel.relation_type, ))
-            conn.commit()
+            delivered = conn.execute("SELECT MIN(seq) FROM consumers WHERE name LIKE 'emitter:%'").fetchone()[0]
+            if delivered is not None:
+                conditions.append('seq <= ?')
+                params.append(delivered)
+            ## (1) collect the expired members in a single pass, then delete them a batch at a time
+            with self.transaction() as cursor:
+                cursor.execute('CREATE TEMP TABLE IF NOT EXISTS expired_members(seq INTEGER PRIMARY KEY)')
+                cursor.execute('CREATE TEMP TABLE IF NOT EXISTS emptied_nodes(uri VARCHAR(2048) PRIMARY KEY)')
+                cursor.execute('DELETE FROM expired_members')
+                cursor.execute('DELETE FROM emptied_nodes')
+                cursor.execute(f'INSERT INTO expired_members SELECT seq FROM (SELECT {columns} FROM members) WHERE {" AND ".join(conditions)}', params)
+                # only the nodes that lose members in this run can be left without any, see (2)
+                cursor.execute('INSERT OR IGNORE INTO emptied_nodes SELECT node_uri FROM members WHERE seq IN (SELECT seq FROM expired_members)')
+            deleted_members = 0
+            batch = 'SELECT seq FROM expired_members ORDER BY seq LIMIT ?'
+            while True:
+                with self.transaction() as cursor:
+                    # an entity whose latest version expired has no versions left at all
+                    cursor.execute(f'DELETE FROM latest_versions WHERE member_uri IN (SELECT uri FROM members WHERE seq IN ({batch}))', (batch_size,))
+                    cursor.execute(f'INSERT OR IGNORE INTO deleted_members SELECT uri FROM members WHERE seq IN ({batch})', (batch_size,))
+                    cursor.execute(f'DELETE FROM members WHERE seq IN ({batch})', (batch_size,))
+                    deleted = cursor.rowcount
+                    cursor.execute(f'DELETE FROM expired_members WHERE seq IN ({batch})', (batch_size,))
+                    done = cursor.rowcount < batch_size
+                deleted_members += deleted
+                conn.execute(f'PRAGMA incremental_vacuum({vacuum_pages})').fetchall()
+                if done:
+                    break
+            ## (2) delete the immutable nodes left without members by this run, except for the root, their relations stay to keep them from
+            ## ... being fetched again, nodes that never had members of their own (inner nodes, or members stored through another node) are kept
+            ## ... the mutable ones (and the root) are still polled, only their payload is dropped
+            deleted_nodes = 0
+            while True:
+                with self.transaction() as cursor:
+                    cursor.execute('''DELETE FROM nodes WHERE rowid IN (SELECT rowid FROM nodes WHERE uri IN (SELECT uri FROM emptied_nodes) AND immutable=1 
+                        AND location<>? AND NOT EXISTS (SELECT 1 FROM members WHERE members.node_uri=nodes.uri) LIMIT ?)''', (view.location, batch_size))
+                    deleted = cursor.rowcount
+                    cursor.execute('''UPDATE nodes SET payload=NULL WHERE rowid IN (SELECT rowid FROM nodes WHERE uri IN (SELECT uri FROM emptied_nodes) 
+                        AND payload IS NOT NULL AND NOT EXISTS (SELECT 1 FROM members WHERE members.node_uri=nodes.uri) LIMIT ?)''', (batch_size,))
+                    emptied = cursor.rowcount
+                deleted_nodes += deleted + emptied
+                conn.execute(f'PRAGMA incremental_vacuum({vacuum_pages})').fetchall()
+                if deleted < batch_size and emptied < batch_size:
+                    break
+            return deleted_members, deleted_nodes
         except Error as err:
             raise LdesClientError(err)
-        finally:
-            conn.close()
 
     #endregion
 
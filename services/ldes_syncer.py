@@ -2,92 +2,322 @@
 LDES SYNCER
 Concerns of the LDES syncer:
  - Synchronizing an LDES stream by regularly polling known mutable LDES nodes
+ - Polling every node when it is due, more often when it changes and less often when it does not
+ - Regularly deleting the members and fragments that fell out of the retention window of the stream
  - [optional extension] Synchronizing an LDES stream by subscribing to a web socket endpoint/Kafka topic/...
 '''
+import datetime
+import itertools
 import schedule
+import sys
+import threading
 import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator, List, Set, Tuple
+from urllib.parse import urlparse
 from models import LdesView, LdesNode, LdesRelation
 from ldes_client_error import LdesClientError
 from services.ldes_store import LdesStore
 from services.ldes_client import LdesClient
+from services.ldes_emitter import LdesEmitter, LdesEmitterDispatcher
+from services.ldes_scheduler import LdesPollingPolicy
+from services.ldes_relation_filter import LdesRelationFilter
+from services.ldes_metrics import LdesMetrics
+
+# members of a node are stored in batches, so that those of a spooled fragment are never all held in memory
+MEMBER_BATCH_SIZE = 1000
 
 
 class LdesSyncer():
     
-    def __init__(self, alias: str, ldes_store: LdesStore, ldes_client: LdesClient):
+    def __init__(self, alias: str, ldes_store: LdesStore, ldes_client: LdesClient, max_workers: int = 8, max_per_host: int = 4, ldes_emitters: List[LdesEmitter] = None,
+            max_poll_interval: int = 3600, gc_interval: int = 3600, metrics: LdesMetrics = None, metrics_file: str = None):
         self.alias = alias
         self.view = None
         self.ldes_store = ldes_store
         self.ldes_client = ldes_client
         self.do_sync=False
+        # fetches run on a thread pool, store writes stay on the syncing thread
+        self.max_workers = max(1, max_workers)
+        self.max_per_host = max(1, max_per_host)
+        self.host_slots = {}
+        self.host_slots_lock = threading.Lock()
+        # new members are handed to the emitters while syncing, see sync()
+        self.ldes_emitters = ldes_emitters or []
+        self.emitter_dispatcher = None
+        # the view's polling interval is the shortest one of the adaptive polling policy, see start_sync()
+        self.max_poll_interval = max_poll_interval
+        self.polling_policy = None
+        self.relation_filter = None
+        # monotonic time of the last garbage collection of the expired members
+        self.gc_interval = gc_interval
+        self.last_gc = None
+        # target locations of the relations the last cycle fetched (or tried to), see get_next_cycle_delay
+        self.attempted: Set[str] = set()
+        # cycles, store writes and work queues are measured per alias, the metrics are written to metrics_file after every cycle
+        self.metrics = metrics if metrics else LdesMetrics()
+        self.metrics_file = metrics_file
 
     def __do_sync(self):
-        print (f"Polling LDES view {self.alias}")
-        ## (1) always poll the root node (view or subset) and add the relations it contains
-        is_changed, view_node, relations = self.ldes_client.get_ldes_node(self.view.location, None)
-        if is_changed:
-            self.handle_node(view_node, relations)
+        with self.metrics.span('sync_cycle', alias=self.alias):
+            self.__poll()
+        self.report_metrics()
 
-        ## (2) poll the any immutable nodes 
-        mutable_nodes = self.ldes_store.get_nodes(mutable_only=True)
-        for node in mutable_nodes:
-            is_changed, the_node, relations = self.ldes_client.get_ldes_node(node.location, node.etag)
+    def __poll(self):
+        print (f"Polling LDES view {self.alias}", file=sys.stderr)
+        cycle_start = datetime.datetime.now(datetime.timezone.utc)
+        ## (1) poll the root node (view or subset) the first time, afterwards it is polled like any other mutable node
+        if not self.ldes_store.get_node_at(self.view.location):
+            is_changed, view_node, relations = self.ldes_client.get_ldes_node(self.view.location, None, self.view)
             if is_changed:
-                print(f"Processing changed node  {node.uri} at location {node.location}")
+                self.handle_node(view_node, relations)
+
+        ## (2) poll the mutable nodes that are due, most overdue first
+        ## ... the nodes due when the cycle started, the ones rescheduled meanwhile wait for the next cycle even when they are due again
+        mutable_nodes = self.ldes_store.iter_pending_nodes(due=cycle_start)
+        for node, (is_changed, the_node, relations) in self.fetch_nodes((node, node.location, node) for node in mutable_nodes):
+            self.metrics.inc('polled_nodes', alias=self.alias, changed=is_changed, description='Mutable nodes polled per alias, changed or not.')
+            if is_changed:
+                print(f"Processing changed node  {node.uri} at location {node.location}", file=sys.stderr)
+                # a stored body hash was compared by the client already, nodes stored without one compare their payload
+                self.polling_policy.schedule(the_node, node.poll_interval, node.content_hash is not None or the_node.payload != node.payload)
                 self.handle_node(the_node, relations)
             else:
-                print(f"Skipping unmodified node {node.uri} at location {node.location} and marking as immutable")
-                # IMPORTANT REMARK: marking as immutable here assuming 304 means that the fragment IS immutable from now on...
-                node.immutable = True
-                self.ldes_store.update_node(node)
+                # a 304 (or identical body) only confirms the node did not change, it is frozen only when the server declares it immutable
+                node.etag, node.last_modified, node.content_hash = the_node.etag, the_node.last_modified, the_node.content_hash
+                node.expires = the_node.expires
+                node.immutable = the_node.immutable
+                self.polling_policy.schedule(node, node.poll_interval, False)
+                print(f"Skipping unmodified node {node.uri} at location {node.location} until {node.next_poll}", file=sys.stderr)
+                self.ldes_store.update_node_schedule(node)
 
         ## (3) process any unprocessed relations by fetching their target nodes and adding their relations in turn
-        relations = self.ldes_store.get_relations(unprocessed_only=True)
+        ## ... the frontier is drained in rounds until a round finds no new relations, so that the relations discovered in a round
+        ## ... (e.g. the next page of a chain of fragments) are followed in the same cycle instead of a polling interval later
+        ## ... every fragment is fetched at most once: the other relations reaching it (fan-in) are only linked to it afterwards,
+        ## ... and relations to targets that were deferred or failed stay pending until the next cycle
+        self.attempted = set()
+        while True:
+            linked_relations = []
+            fetched_any = False
+            for rel, fetched in self.fetch_nodes(self.iter_frontier(self.ldes_store.iter_pending_relations(), linked_relations, self.attempted)):
+                print(f"Processing {rel.relation_type} link to {rel.target_location}", file=sys.stderr)
+                self.handle_relation(rel, fetched)
+                fetched_any = True
+            self.link_relations(linked_relations)
+            # a stop (see stop_sync) is honoured between rounds, a long initial crawl resumes from the pending relations
+            if not fetched_any or not self.ldes_store.get_view().sync:
+                break
+
+        ## (4) regularly delete the members and fragments the retention policies no longer retain
+        if self.last_gc is None or time.monotonic() - self.last_gc >= self.gc_interval:
+            self.last_gc = time.monotonic()
+            members, nodes = self.ldes_store.collect_garbage(self.view)
+            if members or nodes:
+                print(f"Deleted {members} expired members, and deleted or emptied {nodes} fragments", file=sys.stderr)
+
+    def fetch_nodes(self, requests: Iterable[Tuple[object, str, LdesNode]]) -> Iterator[Tuple[object, Tuple[bool, LdesNode, List[LdesRelation]]]]:
+        """Fetches (item, location, stored node) requests concurrently and yields (item, result) pairs in completion order.
+
+        The validators of the stored node (if any) make the fetches conditional.
+        At most max_workers requests are in flight, and at most max_per_host of them against the same host.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            for item, location, stored_node in requests:
+                if len(pending) >= self.max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+                pending[executor.submit(self.__fetch_node, location, stored_node)] = item
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+
+    def __fetch_node(self, location: str, stored_node: LdesNode = None) -> Tuple[bool, LdesNode, List[LdesRelation]]:
+        with self.__host_slot(location):
+            if not stored_node:
+                return self.ldes_client.get_ldes_node(location, None, self.view)
+            return self.ldes_client.get_ldes_node(location, stored_node.etag, self.view, stored_node.last_modified, stored_node.content_hash)
+
+    def __host_slot(self, location: str) -> threading.BoundedSemaphore:
+        host = urlparse(location).netloc
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_slots[host]
+
+    def iter_frontier(self, relations: Iterable[LdesRelation], linked_relations: List[LdesRelation], seen: Set[str]) -> Iterator[Tuple[LdesRelation, str, LdesNode]]:
+        """Yields the fetch requests of the pending relations whose target is neither stored nor fetched yet in this cycle.
+
+        The other relations are collected in linked_relations, their target is (being) stored and polled on its own schedule.
+        The locations of the fragments fetched in this cycle are added to seen, most of them are still in flight or not yet stored.
+        """
         for rel in relations:
-            print(f"Processing {rel.relation_type} link to {rel.target_location}")
-            self.handle_relation(rel)
+            if rel.target_location in seen or self.ldes_store.get_node_at(rel.target_location):
+                linked_relations.append(rel)
+                continue
+            seen.add(rel.target_location)
+            yield rel, rel.target_location, None
+
+    def link_relations(self, relations: List[LdesRelation]):
+        """Marks the relations to stored fragments as processed, the ones whose target was deferred stay pending."""
+        linked = 0
+        with self.ldes_store.transaction():
+            for rel in relations:
+                the_node = self.ldes_store.get_node_at(rel.target_location)
+                if the_node:
+                    rel.is_processed = True
+                    rel.target_node_uri = the_node.uri
+                    self.ldes_store.update_relation(rel)
+                    linked += 1
+        self.metrics.inc('linked_relations', linked, alias=self.alias, description='Relations linked to a fragment fetched through another one.')
+
+    def __relation_request(self, rel: LdesRelation) -> Tuple[LdesRelation, str, LdesNode]:
+        return rel, rel.target_location, self.ldes_store.get_node_at(rel.target_location)
         
     def sync(self):
+        self.start_sync()
+        schedule.every(self.view.polling).seconds.do(self.__do_sync)
+        
+        try:
+            # a (re)started sync resumes right away from the nodes that are due and the pending relations
+            self.__do_sync()
+            while self.view.sync:
+                schedule.run_pending()
+                time.sleep(1)
+                # check for stop signal ...
+                self.view = self.ldes_store.get_view() 
+        finally:
+            self.finish_sync()
+
+    def report_metrics(self):
+        """Updates the work queue and lag gauges of the alias, and writes the metrics file when configured."""
+        stats = self.ldes_store.get_stats()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.metrics.set('due_nodes', stats['due_nodes'], alias=self.alias, description='Mutable nodes due for polling.')
+        self.metrics.set('pending_relations', stats['pending_relations'], alias=self.alias, description='Relations whose target was not fetched yet.')
+        self.metrics.set('members', stats['members'], alias=self.alias, description='Stored members.')
+        self.metrics.set('poll_lag_seconds', max(0, (now - stats['next_poll']).total_seconds()) if stats['next_poll'] else 0, alias=self.alias,
+            description='Seconds the most overdue node is past its poll deadline.')
+        if isinstance(stats['latest_timestamp'], datetime.datetime):
+            self.metrics.set('member_lag_seconds', (now - stats['latest_timestamp']).total_seconds(), alias=self.alias,
+                description='Seconds since the timestamp of the latest stored member.')
+        for consumer, seq in stats['consumers'].items():
+            self.metrics.set('consumer_lag_members', stats['last_seq'] - seq, alias=self.alias, consumer=consumer,
+                description='Members stored after the cursor of a consumer.')
+        if self.metrics_file:
+            self.metrics.write_textfile(self.metrics_file)
+
+    def start_sync(self):
         ## check if a view with the existing alias exists
         self.view = self.ldes_store.get_view()
-        self.view.sync = True
-        self.ldes_store.update_view(self.view)
         if not self.view:
             raise LdesClientError(f'LDES Syncing Error: view alias {self.alias} does not exist. Check the alias or onboard the LDES view first.')
-        schedule.every(self.view.polling).seconds.do(self.__do_sync)
-        
-        while self.view.sync:
-            schedule.run_pending()
-            time.sleep(1)
-            # check for stop signal ...
-            self.view = self.ldes_store.get_view() 
-
-    def handle_node(self, ldes_node: LdesNode, relations: List[LdesRelation]):
-        ## check if the node is already stored
-        the_node = self.ldes_store.get_node(ldes_node.uri)
-        if not the_node:
-            self.ldes_store.create_node(ldes_node)
-        elif not the_node.immutable:
-            self.ldes_store.update_node(ldes_node)
-        
-        for relation in relations:
-            ## check if the relation is already stored
-            the_relation = self.ldes_store.get_relation(relation.source_node, relation.relation_type)
-            if not the_relation:
-                self.ldes_store.create_relation(relation)
+        self.view.sync = True
+        # syncing a view explicitly undoes an earlier stop
+        self.view.stopped = False
+        self.ldes_store.update_view(self.view)
+        if self.ldes_emitters:
+            self.emitter_dispatcher = LdesEmitterDispatcher(lambda: LdesStore(self.ldes_store.location, self.ldes_store.alias), self.ldes_emitters,
+                alias=self.alias)
+            self.emitter_dispatcher.start()
+        self.polling_policy = LdesPollingPolicy(self.view.polling, self.max_poll_interval)
+        self.relation_filter = LdesRelationFilter.from_view(self.view)
+
+    def run_cycle(self):
+        """Runs a single sync cycle, for schedulers other than the one of sync(), like the LDES daemon's."""
+        self.__do_sync()
+
+    def get_next_cycle_delay(self) -> float:
+        """Returns the number of seconds until the next node is due, at most the view's polling interval.
+
+        There is no delay while relations are pending that the last cycle did not get to, e.g. when it was stopped halfway.
+        """
+        if any(rel.target_location not in self.attempted for rel in self.ldes_store.iter_pending_relations()):
+            return 0
+        next_poll = self.ldes_store.get_next_poll()
+        if not next_poll:
+            return self.view.polling
+        delay = (next_poll - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        return min(self.view.polling, max(1, delay))
+
+    def finish_sync(self):
+        if self.emitter_dispatcher:
+            self.emitter_dispatcher.stop()
+            self.emitter_dispatcher = None
 
+    def handle_node(self, ldes_node: LdesNode, relations: List[LdesRelation], rel: LdesRelation = None):
+        ## the node, all of its relations and the relation it was reached through are written as a single unit of work,
+        ## ... so that a sync that is killed halfway resumes from the pending relations without losing or refetching any
+        with self.metrics.span('store_write', alias=self.alias), self.ldes_store.transaction():
+            ## check if the node is already stored
+            the_node = self.ldes_store.get_node(ldes_node.uri)
+            ## a changed node is polled sooner, unless its schedule was already decided
+            if ldes_node.next_poll is None:
+                self.polling_policy.schedule(ldes_node, the_node.poll_interval if the_node else None, True)
+            if not the_node:
+                self.ldes_store.create_node(ldes_node)
+            elif not the_node.immutable:
+                self.ldes_store.update_node(ldes_node)
+            
+            for relation in relations:
+                ## check if the relation is already stored
+                the_relation = self.ldes_store.get_relation(relation.source_node, relation.relation_type, relation.target_location)
+                if not the_relation:
+                    ## relations to subtrees that cannot hold members matching the view's filter are stored as processed
+                    if self.relation_filter and not self.relation_filter.can_match(relation):
+                        print(f"Pruning {relation.relation_type} link to {relation.target_location}", file=sys.stderr)
+                        relation.is_processed = True
+                    self.ldes_store.create_relation(relation)
+
+            ## store the members of the node, members already seen in other nodes are skipped
+            new_members = 0
+            members = iter(ldes_node.members)
+            while batch := list(itertools.islice(members, MEMBER_BATCH_SIZE)):
+                new_members += self.ldes_store.create_members(batch)
+
+            if rel:
+                rel.is_processed = True
+                rel.target_node_uri = ldes_node.uri
+                self.ldes_store.update_relation(rel)
+
+        self.metrics.inc('stored_members', new_members, alias=self.alias, description='Newly stored members.')
+        ## wake up the emitters once the new members are committed
+        if new_members and self.emitter_dispatcher:
+            self.emitter_dispatcher.notify()
     
-    def handle_relation(self, rel: LdesRelation):
-        the_node = self.ldes_store.get_node(rel.target_location)
-        etag = the_node.etag if the_node else None
-        is_changed, node, relations = self.ldes_client.get_ldes_node(rel.target_location, etag)
+    def handle_relation(self, rel: LdesRelation, fetched: Tuple[bool, LdesNode, List[LdesRelation]] = None):
+        if fetched is None:
+            _, location, stored_node = self.__relation_request(rel)
+            fetched = self.__fetch_node(location, stored_node)
+        is_changed, node, relations = fetched
         if is_changed:
-            self.handle_node(node, relations)
-        rel.is_processed = True
-        self.ldes_store.update_relation(rel)
+            self.handle_node(node, relations, rel)
+        elif node.etag or node.last_modified or node.content_hash:
+            # the target is stored already (its validators were sent along) and did not change
+            rel.is_processed = True
+            self.ldes_store.update_relation(rel)
+        # otherwise the target was never fetched and its host asked to retry later, the relation stays pending
     
-    def stop_sync(self):
+    def stop_sync(self, stopped: bool = True):
+        """Flags the view as no longer synced, a stopped view is left alone by the daemon until it is synced or resumed again."""
         self.view = self.ldes_store.get_view()
+        if not self.view:
+            return
         self.view.sync = False
+        self.view.stopped = self.view.stopped or stopped
         self.ldes_store.update_view(self.view)
+
+    def resume_sync(self):
+        """Undoes a stop, so that the daemon syncs the view again once it reloads or is started."""
+        self.view = self.ldes_store.get_view()
+        if not self.view:
+            return
+        self.view.stopped = False
+        self.ldes_store.update_view(self.view)
+
+    def is_stopped(self) -> bool:
+        view = self.ldes_store.get_view()
+        return bool(view and view.stopped)
@@ -0,0 +1,45 @@
+import datetime
+import unittest
+from models.ldes_view import LdesView
+from services.ldes_client import LdesClient
+from services.ldes_ntriples import NTriplesIndex, NTriplesSpool
+
+NODE = 'http://example.org/node'
+VERSION_OF = 'http://purl.org/dc/terms/isVersionOf'
+TIMESTAMP = 'http://www.w3.org/ns/prov#generatedAtTime'
+
+# a fragment without an ldes:EventStream description, the paths of its members are only known to the view
+FRAGMENT = '\n'.join(
+    f'<{NODE}> <https://w3id.org/tree#member> <http://example.org/member/{i}> .\n'
+    f'<http://example.org/member/{i}> <{VERSION_OF}> <http://example.org/entity/{i}> .\n'
+    f'<http://example.org/member/{i}> <{TIMESTAMP}> "2024-01-0{i}T00:00:00Z"^^<http://www.w3.org/2001/XMLSchema#dateTime> .'
+    for i in range(1, 4)).encode()
+
+
+class TestFragmentWithoutStreamDescription(unittest.TestCase):
+
+    def setUp(self):
+        self.client = LdesClient()
+        self.view = LdesView('http://example.org/view', NODE, 'test', version_of_path=VERSION_OF, timestamp_path=TIMESTAMP)
+
+    def assert_members(self, members):
+        self.assertEqual(len(members), 3)
+        for member in members:
+            i = member.uri.rsplit('/', 1)[1]
+            self.assertEqual(member.version_of, f'http://example.org/entity/{i}')
+            self.assertEqual(member.timestamp, datetime.datetime(2024, 1, int(i), tzinfo=datetime.timezone.utc))
+
+    def test_indexed_members_get_the_paths_of_the_view(self):
+        index = NTriplesIndex.from_chunks([FRAGMENT])
+        self.assertIsInstance(index, NTriplesIndex)
+        g = index.structural_graph(self.view.version_of_path, self.view.timestamp_path)
+        self.assert_members(self.client.rdf_get_node_members(NODE, g, self.view, index.cbd))
+
+    def test_spooled_members_get_the_paths_of_the_view(self):
+        spool = NTriplesIndex.from_chunks([FRAGMENT], max_size=1)
+        self.assertIsInstance(spool, NTriplesSpool)
+        self.assert_members(list(self.client.iter_spooled_members(NODE, spool, self.view)))
+
+
+if __name__ == '__main__':
+    unittest.main()